@@ -0,0 +1,160 @@
+import math
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+# Index type used for Lazy RAG: "flat", "ivf_flat", "ivf_pq" or "hnsw".
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")
+FAISS_NLIST = int(os.getenv("FAISS_NLIST", "0"))  # 0 picks ~4 * sqrt(n)
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "8"))
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "16"))
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_EF_CONSTRUCTION = int(os.getenv("FAISS_EF_CONSTRUCTION", "80"))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+# "l2" or "ip" (inner product; equals cosine similarity on L2-normalized vectors)
+FAISS_METRIC = os.getenv("FAISS_METRIC", "l2")
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+# Fewer vectors than this and a type falls back to "flat"
+MIN_TRAINING_VECTORS = {"ivf_flat": 1, "ivf_pq": 16}
+METRICS = {"l2": faiss.METRIC_L2, "ip": faiss.METRIC_INNER_PRODUCT}
+
+
+def _nlist_for(n_vectors, nlist):
+    if not nlist:
+        nlist = int(4 * math.sqrt(n_vectors))
+    # k-means needs at least one training point per centroid.
+    return max(1, min(nlist, n_vectors))
+
+
+def _pq_m_for(dim, pq_m):
+    # PQ needs the sub-quantizer count to divide the dimension.
+    while dim % pq_m:
+        pq_m -= 1
+    return pq_m
+
+
+def build_index(vectors, index_type=FAISS_INDEX_TYPE, nlist=FAISS_NLIST, nprobe=FAISS_NPROBE,
+                pq_m=FAISS_PQ_M, hnsw_m=FAISS_HNSW_M, ef_construction=FAISS_EF_CONSTRUCTION,
+                ef_search=FAISS_EF_SEARCH, metric=FAISS_METRIC):
+    """
+    Build a FAISS index of the requested type and metric ("l2" or "ip") over vectors.
+
+    IVF indexes are trained on the vectors themselves. Types that cannot be
+    trained on so few vectors fall back to an exact flat index.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown FAISS index type {index_type!r}, expected one of {INDEX_TYPES}")
+    if metric not in METRICS:
+        raise ValueError(f"Unknown FAISS metric {metric!r}, expected one of {tuple(METRICS)}")
+
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    n_vectors, dim = vectors.shape
+
+    # Only the trained types need a minimum: IVF centroids need at least one
+    # training point and PQ codes 2**nbits (nbits >= 4, so 16). Flat and HNSW
+    # take any number of vectors.
+    if n_vectors < MIN_TRAINING_VECTORS.get(index_type, 0):
+        index_type = "flat"
+
+    if index_type == "flat":
+        factory = "Flat"
+    elif index_type == "ivf_flat":
+        factory = f"IVF{_nlist_for(n_vectors, nlist)},Flat"
+    elif index_type == "ivf_pq":
+        nbits = min(8, int(math.log2(n_vectors)))
+        factory = f"IVF{_nlist_for(n_vectors, nlist)},PQ{_pq_m_for(dim, pq_m)}x{nbits}"
+    else:
+        factory = f"HNSW{hnsw_m},Flat"
+
+    index = faiss.index_factory(dim, factory, METRICS[metric])
+    if index_type == "hnsw":
+        index.hnsw.efConstruction = ef_construction
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    set_search_params(index, nprobe=nprobe, ef_search=ef_search)
+    return index
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """Apply query-time knobs (IVF nprobe, HNSW efSearch) to whichever index type this is."""
+    if nprobe is not None:
+        try:
+            faiss.extract_index_ivf(index).nprobe = nprobe
+        except RuntimeError:
+            pass
+    if ef_search is not None and hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+
+
+def recall_report(vectors, queries, top_k=3, configs=None):
+    """
+    Compare index types against the exact Flat baseline.
+
+    Returns one dict per config with build time, mean query latency and
+    recall@top_k, where recall is the fraction of Flat's neighbours found.
+    """
+    if configs is None:
+        configs = [
+            {"index_type": "flat"},
+            {"index_type": "ivf_flat", "nprobe": 1},
+            {"index_type": "ivf_flat", "nprobe": 8},
+            {"index_type": "ivf_flat", "nprobe": 32},
+            {"index_type": "ivf_pq", "nprobe": 8},
+            {"index_type": "ivf_pq", "nprobe": 32},
+            {"index_type": "hnsw", "ef_search": 16},
+            {"index_type": "hnsw", "ef_search": 64},
+        ]
+
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(np.ascontiguousarray(vectors, dtype="float32"))
+    _, truth = exact.search(queries, top_k)
+
+    rows = []
+    for config in configs:
+        start = time.perf_counter()
+        index = build_index(vectors, **config)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        _, found = index.search(queries, top_k)
+        latency = (time.perf_counter() - start) / len(queries)
+
+        hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+        rows.append({
+            **config,
+            "build_s": build_time,
+            "latency_ms": latency * 1000,
+            "recall": hits / truth.size,
+        })
+    return rows
+
+
+def print_recall_report(rows, top_k=3):
+    print(f"{'config':<32} {'build s':>9} {'ms/query':>9} {f'recall@{top_k}':>10}")
+    for row in rows:
+        params = {k: v for k, v in row.items() if k not in ("index_type", "build_s", "latency_ms", "recall")}
+        label = row["index_type"] + "".join(f" {k}={v}" for k, v in params.items())
+        print(f"{label:<32} {row['build_s']:>9.3f} {row['latency_ms']:>9.3f} {row['recall']:>10.3f}")
+
+
+if __name__ == "__main__":
+    # Usage: python -m app.ann_index [vectors.npy]
+    # Without an argument, clustered random vectors shaped like MiniLM embeddings are used.
+    rng = np.random.default_rng(0)
+    if len(sys.argv) > 1:
+        vectors = np.load(sys.argv[1]).astype("float32")
+    else:
+        centroids = rng.normal(size=(100, 384))
+        vectors = (centroids[rng.integers(0, 100, 20000)] + rng.normal(scale=0.3, size=(20000, 384))).astype("float32")
+
+    sample = rng.choice(len(vectors), size=min(200, len(vectors)), replace=False)
+    queries = vectors[sample] + rng.normal(scale=0.01, size=(len(sample), vectors.shape[1])).astype("float32")
+
+    print(f"Recall vs latency over {len(vectors)} vectors, {len(queries)} queries:")
+    print_recall_report(recall_report(vectors, queries))
@@ -1,21 +1,28 @@
 from neo4j import GraphDatabase
-from sentence_transformers import SentenceTransformer
 from scipy.spatial.distance import cosine
 import faiss
 import numpy as np
-from transformers import pipeline
+from app.ann_index import FAISS_INDEX_TYPE, FAISS_METRIC, build_index
+from app.model_registry import EMBEDDING_OPTIMIZATION, TEXT2TEXT_OPTIMIZATION, get_model
 import logging as py_logging
 
 py_logging.getLogger("neo4j").setLevel(py_logging.ERROR)
 import os
+import sys
+import time
+
+PRECOMPUTE_PAGE_SIZE = int(os.getenv("PRECOMPUTE_PAGE_SIZE", "5000"))  # nodes read from Neo4j per query
+PRECOMPUTE_BATCH_SIZE = int(os.getenv("PRECOMPUTE_BATCH_SIZE", "64"))  # texts per encode batch
+PRECOMPUTE_PROCESSES = int(os.getenv("PRECOMPUTE_PROCESSES", "1"))  # > 1 encodes on a multi-process pool
+NORMALIZE_EMBEDDINGS = os.getenv("NORMALIZE_EMBEDDINGS", "true").lower() == "true"
 
 # Disable parallelism warning from HuggingFace
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
-from transformers import pipeline
-
-# Set device to "cpu" (or "cuda" for GPU if available and desired)
-response_pipeline = pipeline("text2text-generation", model="t5-small", tokenizer="t5-small", device=0)  # For GPU, set device=0; for CPU, set device=-1
+# Models are loaded once, on first use, on MODEL_DEVICE (see app.model_registry).
+# Inference mode per model: "none" (fp32), "int8" or "onnx".
+EMBEDDING_MODE = EMBEDDING_OPTIMIZATION
+TEXT2TEXT_MODE = TEXT2TEXT_OPTIMIZATION
 
 # Step 1: Precompute and Store Embeddings
 # def precompute_embeddings(driver, model, faiss_index, index_map):
@@ -30,78 +37,134 @@ response_pipeline = pipeline("text2text-generation", model="t5-small", tokenizer
 #             faiss_index.add(np.array([embedding]).astype('float32'))
 #             index_map[len(index_map)] = node_id  # Map FAISS index to node ID
 
-def precompute_embeddings(driver, model, faiss_index, index_map):
-    with driver.session() as session:
-        query = """
-        MATCH (n)
-        RETURN elementId(n) AS id, COALESCE(n.description, n.name) AS text
-        """
-        results = session.run(query)
-
-        for record in results:
-            node_id = record["id"]
-            text = record["text"]
-            if not text:  # Skip nodes without text
-                continue
-            embedding = model.encode(text)
-            faiss_index.add(np.array([embedding]).astype('float32'))
-            index_map[len(index_map)] = node_id  # Map FAISS index to node ID
+def iter_node_pages(driver, page_size=PRECOMPUTE_PAGE_SIZE):
+    """
+    Yield (node ids, texts) pages of nodes with text. A single query is
+    streamed and cut into pages here: the driver pulls page_size records
+    at a time, so memory stays around one page without re-running (and
+    re-sorting) the scan for every page.
+    """
+    query = """
+    MATCH (n)
+    WHERE COALESCE(n.description, n.name) <> ''
+    RETURN elementId(n) AS id, COALESCE(n.description, n.name) AS text
+    """
+    node_ids, texts = [], []
+    with driver.session(fetch_size=page_size) as session:
+        for record in session.run(query):
+            node_ids.append(record["id"])
+            texts.append(record["text"])
+            if len(node_ids) == page_size:
+                yield node_ids, texts
+                node_ids, texts = [], []
+    if node_ids:
+        yield node_ids, texts
+
+def encode_texts(model, texts, batch_size=PRECOMPUTE_BATCH_SIZE, pool=None, normalize=NORMALIZE_EMBEDDINGS):
+    """Encode texts in batches (on a multi-process pool when given) into a float32 matrix."""
+    if pool is not None:
+        vectors = model.encode_multi_process(texts, pool, batch_size=batch_size)
+    else:
+        vectors = model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    if normalize:
+        faiss.normalize_L2(vectors)
+    return vectors
+
+def precompute_embeddings(driver, model, index_map, index_type=FAISS_INDEX_TYPE, page_size=PRECOMPUTE_PAGE_SIZE,
+                          batch_size=PRECOMPUTE_BATCH_SIZE, processes=PRECOMPUTE_PROCESSES,
+                          normalize=NORMALIZE_EMBEDDINGS, metric=FAISS_METRIC):
+    """
+    Embed every node with text and return a FAISS index of index_type over them.
+
+    Nodes are read from Neo4j in pages of page_size and each page is encoded
+    in batches of batch_size, on a pool of processes CPU workers when
+    processes > 1. Vectors are L2-normalized when normalize is set, which
+    makes the "ip" metric a cosine similarity search. IVF index types are
+    trained on the computed embeddings.
+    """
+    pool = model.start_multi_process_pool(["cpu"] * processes) if processes > 1 else None
+    pages = []
+    start = time.perf_counter()
+    try:
+        for node_ids, texts in iter_node_pages(driver, page_size):
+            pages.append(encode_texts(model, texts, batch_size, pool, normalize))
+            for node_id in node_ids:
+                index_map[len(index_map)] = node_id  # Map FAISS index to node ID
+            print(f"Embedded {len(index_map)} nodes ({len(index_map) / (time.perf_counter() - start):.0f} nodes/sec)")
+    finally:
+        if pool is not None:
+            model.stop_multi_process_pool(pool)
+
+    dim = model.get_sentence_embedding_dimension()
+    vectors = np.vstack(pages) if pages else np.zeros((0, dim), dtype="float32")
+    return build_index(vectors, index_type=index_type, metric=metric)
+
+def benchmark_precompute(model, texts, batch_sizes=(16, 64, 256), processes=PRECOMPUTE_PROCESSES):
+    """Print nodes/sec of one encode call per node against batched (and multi-process) encoding."""
+    def timed(label, encode):
+        start = time.perf_counter()
+        encode()
+        elapsed = time.perf_counter() - start
+        print(f"{label:<32} {elapsed:>8.2f} {len(texts) / elapsed:>10.0f}")
+
+    print(f"{'mode':<32} {'seconds':>8} {'nodes/sec':>10}")
+    timed("per node", lambda: [model.encode(text) for text in texts])
+    for batch_size in batch_sizes:
+        timed(f"batched batch_size={batch_size}", lambda: encode_texts(model, texts, batch_size))
+    if processes > 1:
+        pool = model.start_multi_process_pool(["cpu"] * processes)
+        try:
+            for batch_size in batch_sizes:
+                timed(f"{processes} processes batch_size={batch_size}",
+                      lambda: encode_texts(model, texts, batch_size, pool))
+        finally:
+            model.stop_multi_process_pool(pool)
 
 # Step 2: Fine-tune User Query
 def refine_query(user_query):
-    query_refinement_pipeline = pipeline("text2text-generation", model="t5-small", tokenizer="t5-small")
+    query_refinement_pipeline = get_model("text2text", optimization=TEXT2TEXT_MODE)
     refined_query = query_refinement_pipeline(f"Refine: {user_query}", max_length=50, num_return_sequences=1)[0]["generated_text"]
     return refined_query
 
 # Step 3: Search Precomputed Embeddings
-def search_embeddings(query, model, faiss_index, index_map, top_k=3):
-    query_embedding = model.encode(query).astype('float32')
-    distances, indices = faiss_index.search(np.array([query_embedding]), top_k)
-    return [(index_map[i], distances[0][idx]) for idx, i in enumerate(indices[0])]
+def search_embeddings(query, model, faiss_index, index_map, top_k=3, normalize=NORMALIZE_EMBEDDINGS):
+    query_embedding = encode_texts(model, [query], normalize=normalize)
+    distances, indices = faiss_index.search(query_embedding, top_k)
+    return [(index_map[i], distances[0][idx]) for idx, i in enumerate(indices[0]) if i != -1]
 
 # Step 4: Retrieve Details from Neo4j
-# def retrieve_details(driver, node_ids):
-#     details_list = []
-#     with driver.session() as session:
-#         for node_id in node_ids:
-#             query = """
-#             MATCH (n) WHERE id(n) = $node_id
-#             RETURN n.text AS text, [(n)-[r]->(m) | {relation: type(r), target: m.text}] AS relationships
-#             """
-#             result = session.run(query, node_id=node_id)
-#             record = result.single()
-#             if record:
-#                 details_list.append({
-#                     "text": record["text"],
-#                     "relationships": record["relationships"]
-#                 })
-#     return details_list
-
 def retrieve_details(driver, node_ids):
-    details_list = []
+    """
+    Fetch details for all node_ids in one query, in the order of node_ids.
+    Nodes without outgoing relationships are returned with an empty list.
+    """
+    if not node_ids:
+        return []
+
+    query = """
+    UNWIND range(0, size($node_ids) - 1) AS rank
+    MATCH (n) WHERE elementId(n) = $node_ids[rank]
+    RETURN rank, n.description AS description, n.name AS name, n.type AS type,
+           [(n)-[r]->(m) | {relation: type(r), target: m.name, context: r.context}] AS relationships
+    ORDER BY rank
+    """
     with driver.session() as session:
-        for node_id in node_ids:
-            query = """
-            MATCH (n)-[r]->(m)
-            WHERE elementId(n) = $node_id
-            RETURN n.description AS description, n.name AS name, n.type AS type,
-                   [(n)-[r]->(m) | {relation: type(r), target: m.name, context: r.context}] AS relationships
-            """
-            result = session.run(query, node_id=node_id)
-            record = result.single()
-            if record:
-                details_list.append({
-                    "description": record["description"],
-                    "name": record["name"],
-                    "type": record["type"],
-                    "relationships": record["relationships"]
-                })
-    return details_list
+        result = session.run(query, node_ids=list(node_ids))
+        return [
+            {
+                "description": record["description"],
+                "name": record["name"],
+                "type": record["type"],
+                "relationships": record["relationships"]
+            }
+            for record in result
+        ]
 
 # Step 5: Generate Natural Language Answers
 
 def generate_answers(details_list):
-    response_pipeline = pipeline("text2text-generation", model="t5-small", tokenizer="t5-small",)
+    response_pipeline = get_model("text2text", optimization=TEXT2TEXT_MODE)
     answers = []
     for details in details_list:
         text = details.get("text", "")
@@ -121,16 +184,19 @@ if __name__ == "__main__":
     driver = GraphDatabase.driver(neo4j_uri, auth=(neo4j_username, neo4j_password))
 
     # Load embedding model
-    embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+    embedding_model = get_model("embedding", optimization=EMBEDDING_MODE)
 
-    # Initialize FAISS index
-    embedding_dim = 384  # Dimension of MiniLM embeddings
-    faiss_index = faiss.IndexFlatL2(embedding_dim)
-    index_map = {}
+    if "--benchmark" in sys.argv:
+        # Usage: python -m app.lazy_rag --benchmark
+        texts = [text for _, page in iter_node_pages(driver) for text in page]
+        print(f"Encoding throughput over {len(texts)} nodes:")
+        benchmark_precompute(embedding_model, texts)
+        sys.exit()
 
-    # Precompute embeddings and store them
+    # Precompute embeddings and store them in a FAISS index (type set by FAISS_INDEX_TYPE)
+    index_map = {}
     print("Precomputing embeddings...")
-    precompute_embeddings(driver, embedding_model, faiss_index, index_map)
+    faiss_index = precompute_embeddings(driver, embedding_model, index_map)
     print("Embeddings precomputed and stored in FAISS!")
 
     # User query
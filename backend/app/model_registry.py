@@ -0,0 +1,214 @@
+import difflib
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import psutil
+
+# "auto" uses the first GPU when torch can see one, otherwise the CPU.
+MODEL_DEVICE = os.getenv("MODEL_DEVICE", "auto")
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+TEXT2TEXT_MODEL_NAME = os.getenv("TEXT2TEXT_MODEL_NAME", "t5-small")
+# Models loaded (and run once) by warm_up(), comma separated
+WARM_UP_MODELS = os.getenv("WARM_UP_MODELS", "embedding,text2text")
+# Inference mode per model: "none" (fp32 PyTorch), "int8" (dynamic quantization, CPU) or "onnx" (ONNX Runtime)
+EMBEDDING_OPTIMIZATION = os.getenv("EMBEDDING_OPTIMIZATION", "none")
+TEXT2TEXT_OPTIMIZATION = os.getenv("TEXT2TEXT_OPTIMIZATION", "none")
+# Threads for CPU inference (0 leaves the PyTorch / ONNX Runtime default)
+MODEL_NUM_THREADS = int(os.getenv("MODEL_NUM_THREADS", "0"))
+
+OPTIMIZATIONS = ("none", "int8", "onnx")
+DEFAULT_OPTIMIZATIONS = {"embedding": EMBEDDING_OPTIMIZATION, "text2text": TEXT2TEXT_OPTIMIZATION}
+
+_models = {}
+_stats = {}
+_locks = {}
+_registry_lock = threading.Lock()
+
+
+def resolve_device(device=MODEL_DEVICE):
+    if device != "auto":
+        return device
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def _quantize_int8(module):
+    """Replace the Linear layers of a torch module with int8 dynamically quantized ones, in place."""
+    import torch
+    return torch.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def _ort_session_options():
+    try:
+        import onnxruntime
+    except ImportError:
+        raise ImportError("The onnx optimization needs optimum[onnxruntime]: pip install 'optimum[onnxruntime]'")
+    options = onnxruntime.SessionOptions()
+    if MODEL_NUM_THREADS:
+        options.intra_op_num_threads = MODEL_NUM_THREADS
+    return options
+
+
+def _load_embedding(device, optimization="none"):
+    from sentence_transformers import SentenceTransformer
+    if optimization == "onnx":
+        return SentenceTransformer(EMBEDDING_MODEL_NAME, device=device, backend="onnx",
+                                   model_kwargs={"session_options": _ort_session_options()})
+    model = SentenceTransformer(EMBEDDING_MODEL_NAME, device=device)
+    if optimization == "int8":
+        _quantize_int8(model)
+    return model
+
+
+def _load_text2text(device, optimization="none"):
+    from transformers import pipeline
+    if optimization == "onnx":
+        session_options = _ort_session_options()
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+        from transformers import AutoTokenizer
+        model = ORTModelForSeq2SeqLM.from_pretrained(TEXT2TEXT_MODEL_NAME, export=True, session_options=session_options)
+        return pipeline("text2text-generation", model=model, tokenizer=AutoTokenizer.from_pretrained(TEXT2TEXT_MODEL_NAME))
+    model = pipeline("text2text-generation", model=TEXT2TEXT_MODEL_NAME, tokenizer=TEXT2TEXT_MODEL_NAME,
+                     device=device)
+    if optimization == "int8":
+        _quantize_int8(model.model)
+    return model
+
+
+def _warm_embedding(model):
+    model.encode("warm up")
+
+
+def _warm_text2text(model):
+    model("warm up", max_length=5, num_return_sequences=1)
+
+
+# name -> (loader(device), warm-up call)
+LOADERS = {
+    "embedding": (_load_embedding, _warm_embedding),
+    "text2text": (_load_text2text, _warm_text2text),
+}
+
+
+def _parameter_bytes(model):
+    torch_model = getattr(model, "model", model)  # pipelines wrap the torch module
+    if not hasattr(torch_model, "parameters"):
+        return None
+    return sum(p.numel() * p.element_size() for p in torch_model.parameters())
+
+
+def _key(name, optimization):
+    return name if optimization == "none" else f"{name}:{optimization}"
+
+
+def get_model(name, device=None, optimization=None):
+    """
+    Return the shared instance of a registered model in the given
+    optimization mode (the model's *_OPTIMIZATION setting by default),
+    loading it on first use. Concurrent first calls wait for a single load.
+    int8 models always run on the CPU.
+    """
+    optimization = optimization or DEFAULT_OPTIMIZATIONS.get(name, "none")
+    if optimization not in OPTIMIZATIONS:
+        raise ValueError(f"Unknown optimization {optimization!r}, expected one of {OPTIMIZATIONS}")
+    key = _key(name, optimization)
+    model = _models.get(key)
+    if model is not None:
+        return model
+
+    with _registry_lock:
+        lock = _locks.setdefault(key, threading.Lock())
+    with lock:
+        if key not in _models:
+            loader, _ = LOADERS[name]
+            device = "cpu" if optimization == "int8" else resolve_device(device or MODEL_DEVICE)
+            if MODEL_NUM_THREADS and device == "cpu":
+                import torch
+                torch.set_num_threads(MODEL_NUM_THREADS)
+            rss_before = psutil.Process().memory_info().rss
+            start = time.perf_counter()
+            _models[key] = loader(device, optimization)
+            # Quantized weights are packed outside parameters() and ONNX models have none,
+            # so parameter size is only reported for fp32; RSS growth is measured for every mode.
+            parameter_bytes = _parameter_bytes(_models[key]) if optimization == "none" else None
+            _stats[key] = {
+                "device": device,
+                "optimization": optimization,
+                "load_seconds": time.perf_counter() - start,
+                "rss_delta_mb": (psutil.Process().memory_info().rss - rss_before) / 2**20,
+                "parameter_mb": parameter_bytes / 2**20 if parameter_bytes is not None else None,
+            }
+            parameters = (f"{_stats[key]['parameter_mb']:.0f} MB of fp32 parameters, "
+                          if _stats[key]["parameter_mb"] is not None else "")
+            print(f"Loaded {key} on {device} in {_stats[key]['load_seconds']:.1f}s "
+                  f"({parameters}+{_stats[key]['rss_delta_mb']:.0f} MB RSS)")
+        return _models[key]
+
+
+def warm_up(names=None):
+    """Load the given models (WARM_UP_MODELS by default) and run each once."""
+    names = names or [name.strip() for name in WARM_UP_MODELS.split(",") if name.strip()]
+    for name in names:
+        model = get_model(name)
+        start = time.perf_counter()
+        LOADERS[name][1](model)
+        _stats[_key(name, DEFAULT_OPTIMIZATIONS.get(name, "none"))]["warm_up_seconds"] = time.perf_counter() - start
+    return model_stats()
+
+
+def model_stats():
+    """Load time, device and memory of every model loaded so far."""
+    return {name: dict(stats) for name, stats in _stats.items()}
+
+
+BENCHMARK_QUERIES = [
+    "What was the impact of the pandemic on India's economy?",
+    "The prices of what increased in FY23 due to the Russia-Ukraine conflict?",
+    "What was the fiscal deficit of states in FY24?",
+    "How did digitalisation change service delivery?",
+]
+
+
+def benchmark_optimizations(optimizations=OPTIMIZATIONS, queries=BENCHMARK_QUERIES, repeats=5):
+    """
+    Compare optimization modes for both models: mean latency per query,
+    memory added by loading, and output similarity to the first mode
+    (cosine similarity of embeddings, character-level ratio of generated text).
+    """
+    prompts = [f"Generate a simple text response from this context: {query}" for query in queries]
+    baseline = {}
+    print(f"{'model':<20} {'ms/call':>9} {'+RSS MB':>9} {'similarity':>11}")
+    for name in ("embedding", "text2text"):
+        for optimization in optimizations:
+            key = _key(name, optimization)
+            try:
+                model = get_model(name, optimization=optimization)
+            except ImportError as e:
+                print(f"{key:<20} skipped: {e}")
+                continue
+
+            start = time.perf_counter()
+            for _ in range(repeats):
+                if name == "embedding":
+                    outputs = model.encode(queries, normalize_embeddings=True)
+                else:
+                    outputs = [model(prompt, max_length=100, num_return_sequences=1)[0]["generated_text"]
+                               for prompt in prompts]
+            latency = (time.perf_counter() - start) / (repeats * len(queries))
+
+            baseline.setdefault(name, outputs)
+            if name == "embedding":
+                similarity = float(np.mean(np.sum(np.asarray(outputs) * np.asarray(baseline[name]), axis=1)))
+            else:
+                similarity = float(np.mean([difflib.SequenceMatcher(None, a, b).ratio()
+                                            for a, b in zip(outputs, baseline[name])]))
+            print(f"{key:<20} {latency * 1000:>9.1f} {_stats[key]['rss_delta_mb']:>9.0f} {similarity:>11.3f}")
+
+
+if __name__ == "__main__":
+    # Usage: python -m app.model_registry [none int8 onnx]
+    # The first mode listed is the baseline for the similarity column.
+    benchmark_optimizations(sys.argv[1:] or OPTIMIZATIONS)
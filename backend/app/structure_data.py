@@ -1,8 +1,23 @@
 import spacy
+from collections import Counter
+import hashlib
 import json
+import os
+import re
+import sys
+import time
+from app.structured_io import structured_records, write_structured_jsonl
 
-nlp = spacy.load("en_core_web_sm")
-nlp.max_length = 1000000 
+SPACY_MODEL = os.getenv("SPACY_MODEL", "en_core_web_sm")
+SPACY_BATCH_SIZE = int(os.getenv("SPACY_BATCH_SIZE", "64"))  # texts per nlp.pipe batch
+SPACY_N_PROCESS = int(os.getenv("SPACY_N_PROCESS", "1"))  # worker processes for nlp.pipe
+SPACY_CHUNK_SIZE = int(os.getenv("SPACY_CHUNK_SIZE", "5000"))  # characters per boundary-aligned chunk
+
+# Only the parser (dependencies) and ner (entities) are read below.
+UNUSED_COMPONENTS = ("tagger", "attribute_ruler", "lemmatizer", "senter")
+
+nlp = spacy.load(SPACY_MODEL)
+nlp.max_length = 1000000
 
 def split_text_into_chunks(text, max_chunk_size=100000):
     """
@@ -13,14 +28,74 @@ def split_text_into_chunks(text, max_chunk_size=100000):
         chunks.append(text[i:i + max_chunk_size])
     return chunks
 
-def extract_entities_and_relationships(chunk):
-    doc = nlp(chunk)
+def split_text_at_boundaries(text, max_chunk_size=SPACY_CHUNK_SIZE):
+    """
+    Split text into chunks of at most max_chunk_size characters without
+    cutting paragraphs or, where a paragraph is too long, sentences.
+    Only a single sentence longer than max_chunk_size is cut.
+    """
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if len(paragraph) <= max_chunk_size:
+            pieces.append(paragraph)
+            continue
+        for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+            pieces.extend(sentence[i:i + max_chunk_size] for i in range(0, len(sentence), max_chunk_size))
+
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if not piece:
+            continue
+        if current and len(current) + len(piece) + 2 > max_chunk_size:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+def stable_id(text):
+    """Content-derived id: the same text gets the same id in every run (unlike the salted hash())."""
+    normalized = " ".join(text.split()).lower()
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16]
+
+def merge_structured_data(entities, relationships):
+    """
+    Collapse repeated entities (same id) and relationship edges (same from,
+    to and type) into one record each with a "mentions" count. An entity
+    keeps the label it was most often tagged with; otherwise the first
+    occurrence wins.
+    """
+    type_counts = {}
+    by_id_and_type = {}
+    for entity in entities:
+        type_counts.setdefault(entity["id"], Counter())[entity["type"]] += entity.get("mentions", 1)
+        by_id_and_type.setdefault((entity["id"], entity["type"]), entity)
+
+    merged_entities = []
+    for entity_id, counts in type_counts.items():
+        entity_type = counts.most_common(1)[0][0]
+        merged_entities.append({**by_id_and_type[(entity_id, entity_type)], "mentions": sum(counts.values())})
+
+    edges = {}
+    for relationship in relationships:
+        key = (relationship["from"], relationship["to"], relationship["type"])
+        if key in edges:
+            edges[key]["mentions"] += relationship.get("mentions", 1)
+        else:
+            edges[key] = {**relationship, "mentions": relationship.get("mentions", 1)}
+
+    return merged_entities, list(edges.values())
+
+def extract_from_doc(doc):
     entities = []
     relationships = []
 
     for ent in doc.ents:
         entities.append({
-            "id": str(hash(ent.text)), 
+            "id": stable_id(ent.text),
             "name": ent.text,
             "description": f"A {ent.label_} entity, specifically {ent.text}, found in the provided text.",
             "type": ent.label_
@@ -31,41 +106,130 @@ def extract_entities_and_relationships(chunk):
             relationships.append({
                 "type": token.dep_,
                 "context": f"Relation identified as {token.dep_} between {token.head.text} and {token.text}.",
-                "from": str(hash(token.head.text)),
-                "to": str(hash(token.text))
+                "from": stable_id(token.head.text),
+                "to": stable_id(token.text)
             })
 
     return entities, relationships
 
-def process_large_text(file_path, output_file):
+def extract_entities_and_relationships(chunk):
+    return extract_from_doc(nlp(chunk))
+
+def iter_extractions(chunks, batch_size=SPACY_BATCH_SIZE, n_process=SPACY_N_PROCESS):
+    """
+    Yield (entities, relationships, token count) per chunk, in order, via
+    nlp.pipe with UNUSED_COMPONENTS skipped (the model stays loaded once).
+    """
+    for doc in nlp.pipe(chunks, batch_size=batch_size, n_process=n_process, disable=UNUSED_COMPONENTS):
+        entities, relationships = extract_from_doc(doc)
+        yield entities, relationships, len(doc)
+
+def iter_records(chunks, batch_size=SPACY_BATCH_SIZE, n_process=SPACY_N_PROCESS, dedup=True):
+    """
+    Yield (kind, record) pairs chunk by chunk as nlp.pipe produces them.
+    With dedup, an entity id or relationship edge already yielded is
+    skipped; only those keys are remembered, not the records, and no
+    mention counts are kept.
+    """
+    seen = set()
+    for entities, relationships, _ in iter_extractions(chunks, batch_size, n_process):
+        for entity in entities:
+            if dedup and entity["id"] in seen:
+                continue
+            seen.add(entity["id"])
+            yield "entity", entity
+        for relationship in relationships:
+            key = (relationship["from"], relationship["to"], relationship["type"])
+            if dedup and key in seen:
+                continue
+            seen.add(key)
+            yield "relationship", relationship
+
+def process_large_text(file_path, output_file, fast=True, batch_size=SPACY_BATCH_SIZE, n_process=SPACY_N_PROCESS,
+                       dedup=True, stream=False):
+    """
+    Extract the text at file_path into output_file (.jsonl or .json).
+    With stream (fast mode, .jsonl only) records are written as nlp.pipe
+    produces them, so memory stays flat, but repeated entities are only
+    skipped rather than merged with mention counts.
+    """
     with open(file_path, "r", encoding="utf-8") as f:
         raw_text = f.read()
 
     print("Splitting text into chunks...")
-    chunks = split_text_into_chunks(raw_text)
-
     all_entities = []
     all_relationships = []
 
-    for idx, chunk in enumerate(chunks):
-        print(f"Processing chunk {idx + 1}/{len(chunks)}...")
-        entities, relationships = extract_entities_and_relationships(chunk)
-        all_entities.extend(entities)
-        all_relationships.extend(relationships)
+    if stream and fast and output_file.endswith(".jsonl"):
+        chunks = split_text_at_boundaries(raw_text)
+        print(f"Streaming {len(chunks)} chunks to {output_file} (batch_size={batch_size}, n_process={n_process})...")
+        lines = write_structured_jsonl(output_file, iter_records(chunks, batch_size, n_process, dedup))
+        print(f"Structured data saved to {output_file} ({lines} records)")
+        return
+
+    if fast:
+        chunks = split_text_at_boundaries(raw_text)
+        print(f"Processing {len(chunks)} chunks (batch_size={batch_size}, n_process={n_process})...")
+        for entities, relationships, _ in iter_extractions(chunks, batch_size, n_process):
+            all_entities.extend(entities)
+            all_relationships.extend(relationships)
+    else:
+        chunks = split_text_into_chunks(raw_text)
+        for idx, chunk in enumerate(chunks):
+            print(f"Processing chunk {idx + 1}/{len(chunks)}...")
+            entities, relationships = extract_entities_and_relationships(chunk)
+            all_entities.extend(entities)
+            all_relationships.extend(relationships)
+
+    if dedup:
+        mentions = (len(all_entities), len(all_relationships))
+        all_entities, all_relationships = merge_structured_data(all_entities, all_relationships)
+        print(f"Merged {mentions[0]} entity mentions into {len(all_entities)} entities and "
+              f"{mentions[1]} relationship mentions into {len(all_relationships)} edges")
 
     structured_data = {
         "entities": all_entities,
         "relationships": all_relationships
     }
 
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(structured_data, f, indent=4)
+    if output_file.endswith(".jsonl"):
+        write_structured_jsonl(output_file, structured_records(all_entities, all_relationships))
+    else:
+        with open(output_file, "w", encoding="utf-8") as f:
+            json.dump(structured_data, f, indent=4)
 
     print(f"Structured data saved to {output_file}")
 
+def benchmark(text, batch_size=SPACY_BATCH_SIZE, n_process=SPACY_N_PROCESS):
+    """Print tokens/sec of the original 100k-slice loop and of the nlp.pipe mode."""
+    start = time.perf_counter()
+    tokens = entities = 0
+    for chunk in split_text_into_chunks(text):
+        doc = nlp(chunk)
+        tokens += len(doc)
+        entities += len(extract_from_doc(doc)[0])
+    rows = [("100k slices, full pipeline", tokens, entities, time.perf_counter() - start)]
+
+    start = time.perf_counter()
+    tokens = entities = 0
+    for chunk_entities, _, chunk_tokens in iter_extractions(split_text_at_boundaries(text), batch_size, n_process):
+        tokens += chunk_tokens
+        entities += len(chunk_entities)
+    rows.append((f"nlp.pipe batch_size={batch_size} n_process={n_process}", tokens, entities,
+                 time.perf_counter() - start))
+
+    print(f"{'mode':<40} {'tokens':>9} {'entities':>9} {'seconds':>8} {'tokens/s':>9}")
+    for mode, tokens, entities, elapsed in rows:
+        print(f"{mode:<40} {tokens:>9} {entities:>9} {elapsed:>8.2f} {tokens / max(elapsed, 1e-9):>9.0f}")
+
 if __name__ == "__main__":
     raw_text_file = "/Users/mukeshsihag/Desktop/nlp/backend/data/raw_text.txt"
-    output_file = "/Users/mukeshsihag/Desktop/nlp/backend/data/structured_data.json"
-
-    process_large_text(raw_text_file, output_file)
-
+    output_file = "/Users/mukeshsihag/Desktop/nlp/backend/data/structured_data.jsonl"
+
+    if "--benchmark" in sys.argv:
+        # Usage: python -m app.structure_data --benchmark
+        with open(raw_text_file, "r", encoding="utf-8") as f:
+            benchmark(f.read())
+    else:
+        # --stream writes records while extracting instead of merging mentions first
+        process_large_text(raw_text_file, output_file, stream="--stream" in sys.argv)
@@ -3,10 +3,21 @@ from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 from scripts.lazy_rag import lazy_rag_query
 from scripts.naive_rag import naive_rag_query
+from app.model_registry import model_stats, warm_up
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
+import asyncio
+import os
 import psutil
 import time
 
+# Worker threads that run the blocking query pipelines off the event loop
+RAG_WORKER_THREADS = int(os.getenv("RAG_WORKER_THREADS", "8"))
+# Requests taking longer than this are answered with 504. The pipeline itself
+# is not cancelled (a thread cannot be interrupted): it keeps its worker thread
+# until it finishes, so more than RAG_WORKER_THREADS slow queries queue later ones.
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "120"))
+
 app = FastAPI()
 
 # Enable CORS for local development
@@ -21,9 +32,15 @@ app.add_middleware(
 # Precompute embeddings for Lazy RAG
 @app.on_event("startup")
 async def startup_event():
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=RAG_WORKER_THREADS, thread_name_prefix="rag-worker")
+    )
+    print("Loading models...")
+    await asyncio.to_thread(warm_up)
+    print(f"Models loaded: {model_stats()}")
     print("Loading embeddings for Lazy RAG...")
     from scripts.lazy_rag import load_embeddings
-    load_embeddings()
+    await asyncio.to_thread(load_embeddings)
     print("Lazy RAG embeddings loaded.")
 
 # Input model
@@ -51,26 +68,41 @@ def measure_cpu_usage(func, *args, **kwargs):
     time_taken = end_time - start_time  # Total time taken
     return result, cpu_usage, time_taken
 
+@app.get("/models")
+async def get_model_stats():
+    """Device, load time, warm-up time and memory of each loaded model."""
+    return model_stats()
+
 @app.post("/lazy_rag", response_model=QueryResponse)
 async def query_lazy_rag(request: QueryRequest):
     try:
-        answers, cpu_usage, time_taken = measure_cpu_usage(
-            lazy_rag_query, request.question, top_k=request.top_k
+        answers, cpu_usage, time_taken = await asyncio.wait_for(
+            asyncio.to_thread(measure_cpu_usage, lazy_rag_query, request.question, top_k=request.top_k),
+            REQUEST_TIMEOUT
         )
         if not answers:
             raise HTTPException(status_code=404, detail="No relevant information found.")
         return QueryResponse(answers=answers, time_taken=time_taken, cpu_usage=cpu_usage)
+    except HTTPException:
+        raise
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Query timed out.")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/naive_rag", response_model=QueryResponse)
 async def query_naive_rag(request: QueryRequest):
     try:
-        answers, cpu_usage, time_taken = measure_cpu_usage(
-            naive_rag_query, request.question, top_k=request.top_k
+        answers, cpu_usage, time_taken = await asyncio.wait_for(
+            asyncio.to_thread(measure_cpu_usage, naive_rag_query, request.question, top_k=request.top_k),
+            REQUEST_TIMEOUT
         )
         if not answers:
             raise HTTPException(status_code=404, detail="No relevant information found.")
         return QueryResponse(answers=answers, time_taken=time_taken, cpu_usage=cpu_usage)
+    except HTTPException:
+        raise
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Query timed out.")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,12 +1,30 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
-from scripts.lazy_rag import lazy_rag_query
-from scripts.naive_rag import naive_rag_query
-from typing import List
+from fastapi.responses import StreamingResponse
+from scripts import lazy_rag, naive_rag
+from scripts.lazy_rag import alazy_rag_batch, alazy_rag_query, alazy_rag_stream
+from scripts.naive_rag import anaive_rag_query, anaive_rag_stream
+from scripts.answer_cache import SemanticAnswerCache
+from scripts.llm import RAG_ANSWER_MODE
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Literal, Optional
+import asyncio
+import json
+import os
 import psutil
 import time
 
+# Worker threads for blocking embedding, FAISS and Neo4j calls
+RAG_WORKER_THREADS = int(os.getenv("RAG_WORKER_THREADS", "32"))
+# Requests taking longer than this are answered with 504. Pending LLM calls are
+# cancelled; an embedding, FAISS or graph call already running in a worker
+# thread cannot be interrupted and finishes first.
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "120"))
+BATCH_REQUEST_TIMEOUT = float(os.getenv("BATCH_REQUEST_TIMEOUT", "3600"))
+# Seconds between checks for graph changes to fold into the live index (0 disables)
+INDEX_REFRESH_INTERVAL = float(os.getenv("INDEX_REFRESH_INTERVAL", "60"))
+
 app = FastAPI()
 
 # Enable CORS for local development
@@ -21,30 +39,93 @@ app.add_middleware(
 # Precompute embeddings for Lazy RAG
 @app.on_event("startup")
 async def startup_event():
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=RAG_WORKER_THREADS, thread_name_prefix="rag-worker")
+    )
     print("Loading embeddings for Lazy RAG...")
     from scripts.lazy_rag import load_embeddings
-    load_embeddings()
+    await asyncio.to_thread(load_embeddings)
     print("Lazy RAG embeddings loaded.")
+    if INDEX_REFRESH_INTERVAL > 0:
+        asyncio.create_task(refresh_index_periodically())
+
+async def refresh_index_periodically():
+    """Keep the Lazy RAG index in sync with Neo4j without a restart."""
+    while True:
+        await asyncio.sleep(INDEX_REFRESH_INTERVAL)
+        try:
+            stats = await asyncio.to_thread(lazy_rag.refresh_embeddings_if_changed)
+            if stats:
+                print(f"Lazy RAG index refreshed: {stats}")
+        except Exception as e:
+            print(f"Lazy RAG index refresh failed: {e}")
 
 # Input model
 class QueryRequest(BaseModel):
     question: str
     top_k: int = 3  # Default number of top results
+    use_cache: bool = True  # Set to False to bypass the answer cache (e.g. for benchmarks)
+    # "per_node": one answer per retrieved node; "packed": one answer from all of them (RAG_ANSWER_MODE by default)
+    mode: Optional[Literal["per_node", "packed"]] = None
+
+class BatchQueryRequest(BaseModel):
+    questions: List[str]
+    top_k: int = 3
+    mode: Optional[Literal["per_node", "packed"]] = None
 
 # Response model
 class QueryResponse(BaseModel):
     answers: List[str]
     time_taken: float
     cpu_usage: float
+    cache_hit: bool = False
+    cache_hits: int = 0
+    cache_misses: int = 0
+
+class BatchQueryResponse(BaseModel):
+    answers: List[List[str]]  # One list of answers per question, in request order
+    errors: List[Optional[str]]  # Per question: None, or why it has no answers
+    time_taken: float
+    cpu_usage: float
+
+# Answer caches, invalidated whenever the Lazy RAG index version changes
+lazy_rag_cache = SemanticAnswerCache()
+naive_rag_cache = SemanticAnswerCache()
+
+async def answer_with_cache(cache, query_func, embed_func, question, top_k, use_cache=True, mode=None):
+    """
+    Answer from the cache when the question (or a near-identical one) was
+    asked before in the same mode, otherwise await query_func and cache its
+    answers. The question is only embedded when it is not an exact repeat.
+    Returns (answers, cache_hit).
+    """
+    mode = mode or RAG_ANSWER_MODE
+    version = lazy_rag.current_index_version()
+    if use_cache:
+        answers = cache.lookup(question, top_k, version=version, mode=mode, exact_only=True)
+        if answers is not None:
+            return answers, True
+
+    query_embedding = await asyncio.to_thread(embed_func, question)
+    if use_cache:
+        answers = cache.lookup(question, top_k, query_embedding, version, mode)
+        if answers is not None:
+            return answers, True
+
+    answers = await query_func(question, top_k=top_k, query_embedding=query_embedding, mode=mode)
+    if answers and use_cache:
+        cache.store(question, top_k, answers, query_embedding, version, mode)
+    return answers, False
 
-def measure_cpu_usage(func, *args, **kwargs):
+async def measure_cpu_usage(coro_func, *args, timeout=REQUEST_TIMEOUT, **kwargs):
     """
-    Measure CPU usage while running a function.
+    Measure CPU usage while awaiting a coroutine function.
+    The call is cancelled after timeout seconds.
     """
     process = psutil.Process()
     cpu_before = process.cpu_percent(interval=None)  # CPU usage before
     start_time = time.time()  # Time before
-    result = func(*args, **kwargs)  # Execute the function
+    result = await asyncio.wait_for(coro_func(*args, **kwargs), timeout)  # Execute the function
     end_time = time.time()  # Time after
     cpu_after = process.cpu_percent(interval=None)  # CPU usage after
     cpu_usage = (cpu_before + cpu_after) / 2  # Average CPU usage
@@ -54,23 +135,137 @@ def measure_cpu_usage(func, *args, **kwargs):
 @app.post("/lazy_rag", response_model=QueryResponse)
 async def query_lazy_rag(request: QueryRequest):
     try:
-        answers, cpu_usage, time_taken = measure_cpu_usage(
-            lazy_rag_query, request.question, top_k=request.top_k
+        (answers, cache_hit), cpu_usage, time_taken = await measure_cpu_usage(
+            answer_with_cache, lazy_rag_cache, alazy_rag_query, lazy_rag.embed_question,
+            request.question, request.top_k, request.use_cache, request.mode
         )
         if not answers:
             raise HTTPException(status_code=404, detail="No relevant information found.")
-        return QueryResponse(answers=answers, time_taken=time_taken, cpu_usage=cpu_usage)
+        stats = lazy_rag_cache.stats()
+        return QueryResponse(answers=answers, time_taken=time_taken, cpu_usage=cpu_usage,
+                             cache_hit=cache_hit, cache_hits=stats["hits"], cache_misses=stats["misses"])
+    except HTTPException:
+        raise
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Query timed out.")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/lazy_rag/refresh_index")
+async def refresh_lazy_rag_index():
+    """Fold graph changes into the live index now instead of waiting for the next poll."""
+    try:
+        stats = await asyncio.to_thread(lazy_rag.refresh_embeddings)
+        return {**stats, "version": lazy_rag.current_index_version()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/lazy_rag/batch", response_model=BatchQueryResponse)
+async def query_lazy_rag_batch(request: BatchQueryRequest):
+    try:
+        results, cpu_usage, time_taken = await measure_cpu_usage(
+            alazy_rag_batch, request.questions, top_k=request.top_k, mode=request.mode,
+            timeout=BATCH_REQUEST_TIMEOUT
+        )
+        failed = [isinstance(result, BaseException) for result in results]
+        return BatchQueryResponse(
+            answers=[[] if error else result for result, error in zip(results, failed)],
+            errors=[str(result) or type(result).__name__ if error else None for result, error in zip(results, failed)],
+            time_taken=time_taken, cpu_usage=cpu_usage
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Batch query timed out.")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/naive_rag", response_model=QueryResponse)
 async def query_naive_rag(request: QueryRequest):
     try:
-        answers, cpu_usage, time_taken = measure_cpu_usage(
-            naive_rag_query, request.question, top_k=request.top_k
+        (answers, cache_hit), cpu_usage, time_taken = await measure_cpu_usage(
+            answer_with_cache, naive_rag_cache, anaive_rag_query, naive_rag.embed_question,
+            request.question, request.top_k, request.use_cache, request.mode
         )
         if not answers:
             raise HTTPException(status_code=404, detail="No relevant information found.")
-        return QueryResponse(answers=answers, time_taken=time_taken, cpu_usage=cpu_usage)
+        stats = naive_rag_cache.stats()
+        return QueryResponse(answers=answers, time_taken=time_taken, cpu_usage=cpu_usage,
+                             cache_hit=cache_hit, cache_hits=stats["hits"], cache_misses=stats["misses"])
+    except HTTPException:
+        raise
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Query timed out.")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_with_cache(cache, stream_func, embed_func, request):
+    """
+    Server-sent events for one query: stage timings, tokens and answers as
+    they are produced, then a final "done" event with the same metadata as
+    QueryResponse. Cached answers are sent straight away; an exact repeat
+    is answered without embedding the question.
+    """
+    process = psutil.Process()
+    cpu_before = process.cpu_percent(interval=None)
+    start_time = time.time()
+    mode = request.mode or RAG_ANSWER_MODE
+    version = lazy_rag.current_index_version()
+
+    answers = None
+    query_embedding = None
+    if request.use_cache:
+        answers = cache.lookup(request.question, request.top_k, version=version, mode=mode, exact_only=True)
+    if answers is None:
+        embed_start = time.perf_counter()
+        query_embedding = await asyncio.to_thread(embed_func, request.question)
+        yield sse_event("stage", {"stage": "embed", "seconds": time.perf_counter() - embed_start})
+        if request.use_cache:
+            answers = cache.lookup(request.question, request.top_k, query_embedding, version, mode)
+    cache_hit = answers is not None
+    if cache_hit:
+        for index, answer in enumerate(answers):
+            yield sse_event("answer", {"index": index, "text": answer})
+    else:
+        answers_by_index = {}
+        failed = False
+        try:
+            async for event in stream_func(request.question, top_k=request.top_k, query_embedding=query_embedding,
+                                           mode=mode):
+                if event["event"] == "answer":
+                    answers_by_index[event["index"]] = event["text"]
+                failed = failed or event["event"] == "error"
+                yield sse_event(event["event"], event)
+        except Exception as e:
+            yield sse_event("error", {"detail": str(e)})
+            return
+        answers = [answers_by_index[index] for index in sorted(answers_by_index)]
+        if answers and request.use_cache and not failed:
+            cache.store(request.question, request.top_k, answers, query_embedding, version, mode)
+
+    cpu_after = process.cpu_percent(interval=None)
+    stats = cache.stats()
+    yield sse_event("done", {
+        "time_taken": time.time() - start_time,
+        "cpu_usage": (cpu_before + cpu_after) / 2,
+        "cache_hit": cache_hit,
+        "cache_hits": stats["hits"],
+        "cache_misses": stats["misses"],
+    })
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+@app.post("/lazy_rag/stream")
+async def stream_lazy_rag(request: QueryRequest):
+    return StreamingResponse(
+        stream_with_cache(lazy_rag_cache, alazy_rag_stream, lazy_rag.embed_question, request),
+        media_type="text/event-stream", headers=SSE_HEADERS
+    )
+
+@app.post("/naive_rag/stream")
+async def stream_naive_rag(request: QueryRequest):
+    return StreamingResponse(
+        stream_with_cache(naive_rag_cache, anaive_rag_stream, naive_rag.embed_question, request),
+        media_type="text/event-stream", headers=SSE_HEADERS
+    )
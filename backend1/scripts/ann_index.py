@@ -0,0 +1,167 @@
+import math
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+# Index type used for Lazy RAG: "flat", "ivf_flat", "ivf_pq" or "hnsw".
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")
+FAISS_NLIST = int(os.getenv("FAISS_NLIST", "0"))  # 0 picks ~4 * sqrt(n)
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "8"))
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "16"))
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_EF_CONSTRUCTION = int(os.getenv("FAISS_EF_CONSTRUCTION", "80"))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+# Fewer vectors than this and a type falls back to "flat"
+MIN_TRAINING_VECTORS = {"ivf_flat": 1, "ivf_pq": 16}
+
+
+def supports_remove(index_type):
+    """Whether rows can be removed from an index of this type in place (HNSW graphs cannot)."""
+    return index_type != "hnsw"
+
+
+def _nlist_for(n_vectors, nlist):
+    if not nlist:
+        nlist = int(4 * math.sqrt(n_vectors))
+    # k-means needs at least one training point per centroid.
+    return max(1, min(nlist, n_vectors))
+
+
+def _pq_m_for(dim, pq_m):
+    # PQ needs the sub-quantizer count to divide the dimension.
+    while dim % pq_m:
+        pq_m -= 1
+    return pq_m
+
+
+def build_index(vectors, index_type=FAISS_INDEX_TYPE, nlist=FAISS_NLIST, nprobe=FAISS_NPROBE,
+                pq_m=FAISS_PQ_M, hnsw_m=FAISS_HNSW_M, ef_construction=FAISS_EF_CONSTRUCTION,
+                ef_search=FAISS_EF_SEARCH, ids=None):
+    """
+    Build an L2 FAISS index of the requested type over vectors.
+
+    IVF indexes are trained on the vectors themselves. Types that cannot be
+    trained on so few vectors fall back to an exact flat index. When ids are
+    given the index is wrapped in an IndexIDMap2, so searches return those
+    ids and rows can later be removed or added by id.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown FAISS index type {index_type!r}, expected one of {INDEX_TYPES}")
+
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    n_vectors, dim = vectors.shape
+
+    # Only the trained types need a minimum: IVF centroids need at least one
+    # training point and PQ codes 2**nbits (nbits >= 4, so 16). Flat and HNSW
+    # take any number of vectors.
+    if n_vectors < MIN_TRAINING_VECTORS.get(index_type, 0):
+        index_type = "flat"
+
+    if index_type == "flat":
+        factory = "Flat"
+    elif index_type == "ivf_flat":
+        factory = f"IVF{_nlist_for(n_vectors, nlist)},Flat"
+    elif index_type == "ivf_pq":
+        nbits = min(8, int(math.log2(n_vectors)))
+        factory = f"IVF{_nlist_for(n_vectors, nlist)},PQ{_pq_m_for(dim, pq_m)}x{nbits}"
+    else:
+        factory = f"HNSW{hnsw_m},Flat"
+
+    index = faiss.index_factory(dim, factory, faiss.METRIC_L2)
+    if index_type == "hnsw":
+        index.hnsw.efConstruction = ef_construction
+    if not index.is_trained:
+        index.train(vectors)
+    if ids is None:
+        index.add(vectors)
+    else:
+        index = faiss.IndexIDMap2(index)
+        index.add_with_ids(vectors, np.asarray(ids, dtype="int64"))
+    set_search_params(index, nprobe=nprobe, ef_search=ef_search)
+    return index
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """Apply query-time knobs (IVF nprobe, HNSW efSearch) to whichever index type this is."""
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    if nprobe is not None:
+        try:
+            faiss.extract_index_ivf(index).nprobe = nprobe
+        except RuntimeError:
+            pass
+    if ef_search is not None and hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+
+
+def recall_report(vectors, queries, top_k=3, configs=None):
+    """
+    Compare index types against the exact Flat baseline.
+
+    Returns one dict per config with build time, mean query latency and
+    recall@top_k, where recall is the fraction of Flat's neighbours found.
+    """
+    if configs is None:
+        configs = [
+            {"index_type": "flat"},
+            {"index_type": "ivf_flat", "nprobe": 1},
+            {"index_type": "ivf_flat", "nprobe": 8},
+            {"index_type": "ivf_flat", "nprobe": 32},
+            {"index_type": "ivf_pq", "nprobe": 8},
+            {"index_type": "ivf_pq", "nprobe": 32},
+            {"index_type": "hnsw", "ef_search": 16},
+            {"index_type": "hnsw", "ef_search": 64},
+        ]
+
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(np.ascontiguousarray(vectors, dtype="float32"))
+    _, truth = exact.search(queries, top_k)
+
+    rows = []
+    for config in configs:
+        start = time.perf_counter()
+        index = build_index(vectors, **config)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        _, found = index.search(queries, top_k)
+        latency = (time.perf_counter() - start) / len(queries)
+
+        hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+        rows.append({
+            **config,
+            "build_s": build_time,
+            "latency_ms": latency * 1000,
+            "recall": hits / truth.size,
+        })
+    return rows
+
+
+def print_recall_report(rows, top_k=3):
+    print(f"{'config':<32} {'build s':>9} {'ms/query':>9} {f'recall@{top_k}':>10}")
+    for row in rows:
+        params = {k: v for k, v in row.items() if k not in ("index_type", "build_s", "latency_ms", "recall")}
+        label = row["index_type"] + "".join(f" {k}={v}" for k, v in params.items())
+        print(f"{label:<32} {row['build_s']:>9.3f} {row['latency_ms']:>9.3f} {row['recall']:>10.3f}")
+
+
+if __name__ == "__main__":
+    # Usage: python -m scripts.ann_index [vectors.npy]
+    # Without an argument, the vectors of the Lazy RAG index snapshot are used.
+    from scripts.index_store import INDEX_SNAPSHOT_DIR
+
+    vectors_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(INDEX_SNAPSHOT_DIR, "vectors.npy")
+    vectors = np.load(vectors_path).astype("float32")
+
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(vectors), size=min(200, len(vectors)), replace=False)
+    queries = vectors[sample] + rng.normal(scale=0.01, size=(len(sample), vectors.shape[1])).astype("float32")
+
+    print(f"Recall vs latency over {len(vectors)} vectors, {len(queries)} queries:")
+    print_recall_report(recall_report(vectors, queries))
@@ -0,0 +1,108 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1024"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+# Answer of a query without retrieved nodes; never cached, the graph may gain the answer
+NO_ANSWER = "No relevant information found."
+
+
+def normalize_question(question):
+    """Lowercase, drop punctuation and collapse whitespace."""
+    return " ".join(re.sub(r"[^\w\s]", " ", question.lower()).split())
+
+
+class SemanticAnswerCache:
+    """
+    Answer cache for RAG endpoints.
+
+    A question is an exact hit when its normalized text was seen before, and
+    a near hit when the cosine similarity between its embedding and a cached
+    question's embedding is at least similarity_threshold. Entries expire
+    after ttl seconds, the least recently used entry is evicted beyond
+    max_entries, and everything is dropped when the index version changes.
+    Answers are only shared between requests with the same top_k and mode.
+    """
+
+    def __init__(self, ttl=ANSWER_CACHE_TTL, max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                 similarity_threshold=ANSWER_CACHE_SIMILARITY):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (top_k, mode, normalized question) -> (answers, unit embedding, expires_at)
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _sync(self, version):
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+        now = time.monotonic()
+        for key in [key for key, (_, _, expires_at) in self._entries.items() if expires_at <= now]:
+            del self._entries[key]
+
+    @staticmethod
+    def _unit(embedding):
+        if embedding is None:
+            return None
+        vector = np.asarray(embedding, dtype="float32")
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def lookup(self, question, top_k, embedding=None, version=None, mode=None, exact_only=False):
+        """
+        Return cached answers for question, or None on a miss. With
+        exact_only, only the normalized question is looked up and a miss is
+        not counted, so callers can skip embedding the question on a repeat.
+        """
+        key = (top_k, mode, normalize_question(question))
+        with self._lock:
+            self._sync(version)
+
+            entry = self._entries.get(key)
+            if entry is None and exact_only:
+                return None
+            if entry is None:
+                query = self._unit(embedding)
+                candidates = [
+                    (k, e) for k, e in self._entries.items()
+                    if k[:2] == key[:2] and e[1] is not None and query is not None
+                ]
+                if candidates:
+                    similarities = np.stack([e[1] for _, e in candidates]) @ query
+                    best = int(np.argmax(similarities))
+                    if similarities[best] >= self.similarity_threshold:
+                        key, entry = candidates[best]
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[0])
+
+    def store(self, question, top_k, answers, embedding=None, version=None, mode=None):
+        if list(answers) == [NO_ANSWER]:
+            return
+        key = (top_k, mode, normalize_question(question))
+        with self._lock:
+            self._sync(version)
+            self._entries[key] = (list(answers), self._unit(embedding), time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
@@ -1,11 +1,18 @@
-from neo4j import GraphDatabase
-import json
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 import os
+import sys
+import time
+from scripts.graph_store import GRAPH_BACKEND, get_graph_store
+from scripts.structured_io import iter_structured_data
 
 load_dotenv()
 
+NEO4J_BATCH_SIZE = int(os.getenv("NEO4J_BATCH_SIZE", "1000"))  # rows per UNWIND transaction
+NEO4J_WRITERS = int(os.getenv("NEO4J_WRITERS", "1"))  # parallel write transactions
+
 def get_neo4j_driver(uri, username, password):
+    from neo4j import GraphDatabase  # only needed for GRAPH_BACKEND=neo4j
     return GraphDatabase.driver(uri, auth=(username, password))
 
 def store_entities(driver, entities):
@@ -16,7 +23,8 @@ def store_entities(driver, entities):
                 MERGE (e:Entity {id: $id})
                 SET e.name = $name,
                     e.description = $description,
-                    e.type = $type
+                    e.type = $type,
+                    e.updated_at = timestamp()
                 """,
                 id=entity["id"],
                 name=entity["name"],
@@ -40,31 +48,108 @@ def store_relationships(driver, relationships):
                 context=relationship.get("context", "")
             )
 
-def main():
-    structured_data_file = "/Users/mukeshsihag/Desktop/nlp/backend1/data/structured_data.json"
+def create_constraints(driver):
+    """Unique Entity.id, so MERGE and MATCH by id are index lookups instead of label scans."""
+    with driver.session() as session:
+        session.run("CREATE CONSTRAINT entity_id IF NOT EXISTS FOR (e:Entity) REQUIRE e.id IS UNIQUE")
+        session.run("CREATE INDEX entity_updated_at IF NOT EXISTS FOR (e:Entity) ON (e.updated_at)")
 
-    neo4j_uri =  "bolt://localhost:7689"
-    neo4j_username =  "neo4j"
-    neo4j_password =  "12345678"
+def _batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
-    driver = get_neo4j_driver(neo4j_uri, neo4j_username, neo4j_password)
+def _write_batch(driver, query, batch):
+    with driver.session() as session:
+        session.execute_write(lambda tx: tx.run(query, rows=batch).consume())
+    return len(batch)
+
+def _bulk_write(driver, query, rows, batch_size, writers):
+    """
+    Run query once per batch of rows, each batch in its own write transaction.
+    With writers > 1 up to that many transactions run in parallel; at most
+    2 * writers batches are held in memory. Returns (rows written, seconds).
+    """
+    start = time.perf_counter()
+    written = 0
+    if writers <= 1:
+        for batch in _batches(rows, batch_size):
+            written += _write_batch(driver, query, batch)
+        return written, time.perf_counter() - start
 
-    try:
-        with open(structured_data_file, "r", encoding="utf-8") as f:
-            structured_data = json.load(f)
+    with ThreadPoolExecutor(max_workers=writers) as executor:
+        pending = set()
+        for batch in _batches(rows, batch_size):
+            if len(pending) >= 2 * writers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                written += sum(future.result() for future in done)
+            pending.add(executor.submit(_write_batch, driver, query, batch))
+        written += sum(future.result() for future in pending)
+    return written, time.perf_counter() - start
 
-        entities = structured_data.get("entities", [])
-        relationships = structured_data.get("relationships", [])
+def store_entities_bulk(driver, entities, batch_size=NEO4J_BATCH_SIZE, writers=NEO4J_WRITERS):
+    query = """
+    UNWIND $rows AS row
+    MERGE (e:Entity {id: row.id})
+    SET e.name = row.name,
+        e.description = row.description,
+        e.type = row.type,
+        e.mentions = row.mentions,
+        e.updated_at = timestamp()
+    """
+    rows = (
+        {"id": entity["id"], "name": entity["name"], "description": entity["description"], "type": entity["type"],
+         "mentions": entity.get("mentions", 1)}
+        for entity in entities
+    )
+    count, elapsed = _bulk_write(driver, query, rows, batch_size, writers)
+    print(f"Stored {count} entities in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} rows/sec)")
+    return count
 
-        print("Storing entities...")
-        store_entities(driver, entities)
+def store_relationships_bulk(driver, relationships, batch_size=NEO4J_BATCH_SIZE, writers=NEO4J_WRITERS):
+    """
+    Parallel writers may deadlock on shared nodes; the driver retries those
+    transactions, but writers=1 is the safe choice for dense graphs.
+    """
+    query = """
+    UNWIND $rows AS row
+    MATCH (a:Entity {id: row.from_id})
+    MATCH (b:Entity {id: row.to_id})
+    MERGE (a)-[r:RELATIONSHIP {type: row.type}]->(b)
+    SET r.context = row.context,
+        r.mentions = row.mentions
+    """
+    rows = (
+        {
+            "from_id": relationship["from"],
+            "to_id": relationship["to"],
+            "type": relationship["type"],
+            "context": relationship.get("context", ""),
+            "mentions": relationship.get("mentions", 1)
+        }
+        for relationship in relationships
+    )
+    count, elapsed = _bulk_write(driver, query, rows, batch_size, writers)
+    print(f"Stored {count} relationships in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} rows/sec)")
+    return count
 
-        print("Storing relationships...")
-        store_relationships(driver, relationships)
+def main():
+    # .jsonl files are streamed; the older .json format is loaded in one piece
+    structured_data_file = sys.argv[1] if len(sys.argv) > 1 else "/Users/mukeshsihag/Desktop/nlp/backend1/data/structured_data.jsonl"
 
-        print("Data successfully stored in Neo4j!")
-    finally:
-        driver.close()
+    # Two passes over the file: every node exists before relationships MATCH on it.
+    # With GRAPH_BACKEND=memory this only loads and checks the file: the server
+    # reads GRAPH_DATA_PATH itself.
+    get_graph_store().load(
+        iter_structured_data(structured_data_file, "entity"),
+        iter_structured_data(structured_data_file, "relationship"),
+    )
+    print(f"Data successfully stored in the {GRAPH_BACKEND} graph store!")
 
 if __name__ == "__main__":
     main()
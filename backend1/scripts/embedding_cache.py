@@ -0,0 +1,111 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from scripts.embeddings import (
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_MAX_CONCURRENCY,
+    embedding_model_name,
+    iter_embedding_batches,
+)
+
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "embedding_cache.sqlite3"),
+)
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", "10000"))
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache.
+
+    Vectors are stored in SQLite keyed by a hash of the embedding model name
+    and the text, with an in-memory LRU of max_memory_items in front of it.
+    """
+
+    def __init__(self, model, path=EMBEDDING_CACHE_PATH, max_memory_items=EMBEDDING_CACHE_MEMORY_ITEMS):
+        self.model = model
+        self.model_name = embedding_model_name(model)
+        self.max_memory_items = max_memory_items
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._conn.commit()
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+
+            pending = [key for key in keys if key not in found]
+            # Stay well below SQLite's limit on bound parameters per statement.
+            for start in range(0, len(pending), 500):
+                batch = pending[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype="float32")
+                    found[key] = vector
+                    self._remember(key, vector)
+        return found
+
+    def _store(self, keys, vectors):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, vector.tobytes()) for key, vector in zip(keys, vectors)],
+            )
+            self._conn.commit()
+            for key, vector in zip(keys, vectors):
+                self._remember(key, vector)
+
+    def embed(self, texts, batch_size=EMBEDDING_BATCH_SIZE, max_concurrency=EMBEDDING_MAX_CONCURRENCY):
+        """Return a float32 matrix of embeddings for texts, embedding only cache misses."""
+        keys = [self._key(text) for text in texts]
+        found = self._lookup(list(dict.fromkeys(keys)))
+
+        cached = sum(1 for key in keys if key in found)
+        self.hits += cached
+        self.misses += len(keys) - cached
+
+        missing = list(dict.fromkeys(key for key in keys if key not in found))
+        missing_texts = {key: text for key, text in zip(keys, texts) if key not in found}
+
+        batch_texts = [missing_texts[key] for key in missing]
+        for start, batch in iter_embedding_batches(batch_texts, self.model, batch_size, max_concurrency):
+            batch_keys = missing[start:start + len(batch)]
+            self._store(batch_keys, batch)
+            found.update(zip(batch_keys, batch))
+
+        if not keys:
+            return np.empty((0, 0), dtype="float32")
+        return np.vstack([found[key] for key in keys])
+
+    def close(self):
+        self._conn.close()
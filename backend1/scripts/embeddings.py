@@ -0,0 +1,88 @@
+import hashlib
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class FakeEmbeddings:
+    """
+    Offline stand-in for OpenAIEmbeddings.
+
+    Texts are embedded as hashed bag-of-words vectors, so the output is
+    deterministic and texts sharing words end up close to each other.
+    """
+
+    def __init__(self, dim=1536):
+        self.dim = dim
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype="float32")
+        for token in _TOKEN_PATTERN.findall(text.lower()):
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+
+def get_embedding_model(provider=None):
+    """Return the embedding model selected by EMBEDDING_PROVIDER ("openai" or "fake")."""
+    provider = provider or EMBEDDING_PROVIDER
+    if provider == "fake":
+        return FakeEmbeddings()
+    if provider != "openai":
+        raise ValueError(f"Unknown embedding provider: {provider}")
+
+    from langchain.embeddings import OpenAIEmbeddings
+    return OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
+
+
+def iter_embedding_batches(texts, model, batch_size=EMBEDDING_BATCH_SIZE,
+                           max_concurrency=EMBEDDING_MAX_CONCURRENCY):
+    """
+    Embed texts in batches, with at most max_concurrency batches in flight.
+
+    Yields (start, vectors) in input order, where vectors is a contiguous
+    float32 matrix for texts[start:start + len(vectors)].
+    """
+    starts = range(0, len(texts), batch_size)
+
+    def embed_batch(start):
+        vectors = model.embed_documents(texts[start:start + batch_size])
+        return start, np.ascontiguousarray(vectors, dtype="float32")
+
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        yield from executor.map(embed_batch, starts)
+
+
+def embed_texts(texts, model, batch_size=EMBEDDING_BATCH_SIZE,
+                max_concurrency=EMBEDDING_MAX_CONCURRENCY):
+    """Embed texts into a single float32 matrix of shape (len(texts), dim)."""
+    batches = [vectors for _, vectors in iter_embedding_batches(texts, model, batch_size, max_concurrency)]
+    if not batches:
+        return np.empty((0, 0), dtype="float32")
+    return np.vstack(batches)
+
+
+def embedding_model_name(model):
+    """Identifier of the model that produced a set of embeddings."""
+    return getattr(model, "model", None) or type(model).__name__
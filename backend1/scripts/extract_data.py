@@ -1,23 +1,92 @@
 import PyPDF2
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+import time
+
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "8"))  # pages handed to a worker at once
 
 def extract_text_from_pdf(pdf_path, start_page, end_page):
     pdf_text = []
     with open(pdf_path, "rb") as f:
         pdf_reader = PyPDF2.PdfReader(f)
         for page in range(start_page - 1, end_page):
-            pdf_text.append(pdf_reader.pages[page].extract_text())
+            pdf_text.append(pdf_reader.pages[page].extract_text() or "")
     return "\n".join(pdf_text)
 
+def page_count(pdf_path):
+    with open(pdf_path, "rb") as f:
+        return len(PyPDF2.PdfReader(f).pages)
+
+def _extract_page_range(pdf_path, start_page, end_page):
+    """Runs in a worker process: one record per page in [start_page, end_page]."""
+    records = []
+    with open(pdf_path, "rb") as f:
+        pdf_reader = PyPDF2.PdfReader(f)
+        for page in range(start_page, end_page + 1):
+            text = pdf_reader.pages[page - 1].extract_text() or ""  # image-only pages have no text
+            records.append({
+                "page": page,
+                "text": text,
+                "hash": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+            })
+    return records
+
+def iter_page_records(pdf_path, start_page=1, end_page=None, workers=PDF_EXTRACT_WORKERS,
+                      pages_per_task=PDF_PAGES_PER_TASK):
+    """
+    Yield {"page", "text", "hash"} records in page order, extracting page
+    ranges in a process pool. At most 2 * workers ranges are in flight, so
+    memory stays bounded however long the PDF is.
+    """
+    end_page = end_page or page_count(pdf_path)
+    ranges = (
+        (first, min(first + pages_per_task - 1, end_page))
+        for first in range(start_page, end_page + 1, pages_per_task)
+    )
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as executor:
+        in_flight = deque()
+        for first, last in ranges:
+            in_flight.append(executor.submit(_extract_page_range, pdf_path, first, last))
+            if len(in_flight) >= 2 * workers:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+def extract_pages_to_jsonl(pdf_path, output_jsonl_file, output_txt_file=None, start_page=1, end_page=None,
+                           workers=PDF_EXTRACT_WORKERS, pages_per_task=PDF_PAGES_PER_TASK):
+    """
+    Stream page records to a JSONL file (and optionally the page texts to a
+    plain text file) as they are extracted. Returns the number of pages.
+    """
+    start = time.perf_counter()
+    pages = 0
+    txt = open(output_txt_file, "w", encoding="utf-8") if output_txt_file else None
+    try:
+        with open(output_jsonl_file, "w", encoding="utf-8") as jsonl:
+            for record in iter_page_records(pdf_path, start_page, end_page, workers, pages_per_task):
+                jsonl.write(json.dumps(record) + "\n")
+                if txt:
+                    txt.write(("\n" if pages else "") + record["text"])
+                pages += 1
+    finally:
+        if txt:
+            txt.close()
+    elapsed = time.perf_counter() - start
+    print(f"Extracted {pages} pages in {elapsed:.1f}s ({pages / max(elapsed, 1e-9):.1f} pages/sec)")
+    return pages
+
 if __name__ == "__main__":
     pdf_path = "/Users/mukeshsihag/Desktop/nlp/backend1/data/economy_survey.pdf"
+    output_jsonl_file = "/Users/mukeshsihag/Desktop/nlp/backend1/data/raw_pages.jsonl"
     output_txt_file = "/Users/mukeshsihag/Desktop/nlp/backend1/data/raw_text.txt"
     start_page = 1
-    end_page = 35
+    end_page = None  # None extracts to the last page
 
     print("Extracting text from PDF...")
-    text = extract_text_from_pdf(pdf_path, start_page, end_page)
-
-    with open(output_txt_file, "w", encoding="utf-8") as f:
-        f.write(text)
+    extract_pages_to_jsonl(pdf_path, output_jsonl_file, output_txt_file, start_page, end_page)
 
     print(f"Raw text extracted and saved to {output_txt_file}")
@@ -1,14 +1,122 @@
 from openai import OpenAI
+import openai
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from types import SimpleNamespace
+import hashlib
+import httpx
 import json
+import numpy as np
 from dotenv import load_dotenv
 import os
+import random
+import re
+import threading
+import time
+from scripts.structured_io import structured_records, write_structured_jsonl
 
 load_dotenv()
 
-# Load OpenAI API key
-client = OpenAI(
-    api_key=os.getenv("OPENAI_API_KEY")
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")  # or "fake" for offline runs
+EXTRACTION_MODEL = os.getenv("EXTRACTION_MODEL", "gpt-4o-mini")
+EXTRACTION_MAX_CONCURRENCY = int(os.getenv("EXTRACTION_MAX_CONCURRENCY", "4"))  # chunks in flight at once
+EXTRACTION_MAX_RETRIES = int(os.getenv("EXTRACTION_MAX_RETRIES", "5"))
+EXTRACTION_BACKOFF = float(os.getenv("EXTRACTION_BACKOFF", "1.0"))  # seconds, doubled on every retry
+# Append-only JSONL of parsed chunk results; doubles as the resume checkpoint ("" disables)
+EXTRACTION_CACHE_PATH = os.getenv(
+    "EXTRACTION_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "extraction_cache.jsonl"),
 )
+# Cosine similarity above which two entity names of the same type are merged (0 disables fuzzy matching)
+ENTITY_MATCH_THRESHOLD = float(os.getenv("ENTITY_MATCH_THRESHOLD", "0.9"))
+ENTITY_MATCH_TOP_K = int(os.getenv("ENTITY_MATCH_TOP_K", "5"))  # most similar merge candidates kept per name
+# A name token shared by more names of one type than this is too common to block on
+ENTITY_BLOCK_MAX_SIZE = int(os.getenv("ENTITY_BLOCK_MAX_SIZE", "256"))
+LLM_FAKE_LATENCY = float(os.getenv("LLM_FAKE_LATENCY", "0.5"))
+LLM_FAKE_RATE_LIMIT = float(os.getenv("LLM_FAKE_RATE_LIMIT", "0"))  # probability of a simulated 429
+
+SYSTEM_PROMPT = (
+    "Extract entities and relationships in JSON format to store them in a Neo4j database. "
+    "Return the response in the following structure. The keys should be present in the entities and relationships:\n\n"
+    "{\n"
+    '  "entities": [\n'
+    '    { "id": "1", "name": "India", "type": "Country", "description": "A country in South Asia." },\n'
+    '    { "id": "2", "name": "Pandemic", "type": "Event", "description": "Global outbreak of a disease." }\n'
+    "  ],\n"
+    '  "relationships": [\n'
+    '    { "from": "1", "to": "2", "type": "affected_by", "context": "Economic impact due to the pandemic" }\n'
+    "  ]\n"
+    "}\n\n"
+    "Make sure to store longer sentences in the description and context fields so that meaningful answers can be retrieved."
+)
+
+_RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class FakeOpenAIClient:
+    """
+    Offline stand-in for OpenAI() exposing client.chat.completions.create.
+    Capitalized words of the chunk become entities, linked in order of
+    appearance, after a fixed delay. A fraction of calls (rate_limit) fail
+    with a 429 to exercise the retry path.
+    """
+
+    def __init__(self, latency=LLM_FAKE_LATENCY, rate_limit=LLM_FAKE_RATE_LIMIT):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model, messages, **kwargs):
+        time.sleep(self.latency)
+        if random.random() < self.rate_limit:
+            request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+            raise openai.RateLimitError("Simulated rate limit", response=httpx.Response(429, request=request), body=None)
+
+        chunk = messages[-1]["content"]
+        names = list(dict.fromkeys(re.findall(r"\b[A-Z][a-zA-Z]{2,}\b", chunk)))[:5]
+        entities = [
+            {"id": str(i + 1), "name": name, "type": "Concept", "description": f"{name} is mentioned in the text."}
+            for i, name in enumerate(names)
+        ]
+        relationships = [
+            {"from": str(i), "to": str(i + 1), "type": "mentioned_with",
+             "context": f"{names[i - 1]} is mentioned with {names[i]}."}
+            for i in range(1, len(names))
+        ]
+        content = json.dumps({"entities": entities, "relationships": relationships})
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def chunk_key(chunk, model=EXTRACTION_MODEL, prompt=SYSTEM_PROMPT, provider=LLM_PROVIDER):
+    """Cache key of a chunk's result: changes whenever the text, provider, model or prompt does."""
+    return hashlib.sha256(f"{provider}:{model}\0{prompt}\0{chunk}".encode("utf-8")).hexdigest()
+
+
+def load_extraction_cache(path=EXTRACTION_CACHE_PATH):
+    """Read {key: normalized result} from the JSONL cache, skipping a line cut short by a crash."""
+    cache = {}
+    if not path or not os.path.exists(path):
+        return cache
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            # Re-normalized so results cached by older versions get the same cleanup.
+            cache[record["key"]] = normalize_data(record["result"])
+    return cache
+
+
+def get_client():
+    if LLM_PROVIDER == "fake":
+        return FakeOpenAIClient()
+    # Retries are done by extract_chunk so that they back off per chunk.
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
 
 
 def split_text_into_chunks(text, max_length=2000):
@@ -53,61 +161,274 @@ def normalize_data(structured_data):
     required_entity_keys = {"id", "name", "type", "description"}
     required_relationship_keys = {"from", "to", "type", "context"}
 
+    # Missing and null fields both become "", so a "name": null from the LLM is an empty name.
     for entity in structured_data.get("entities", []):
-        normalized_entity = {key: entity.get(key, "") for key in required_entity_keys}
+        normalized_entity = {key: "" if entity.get(key) is None else entity[key] for key in required_entity_keys}
         normalized_entities.append(normalized_entity)
 
     for relationship in structured_data.get("relationships", []):
-        normalized_relationship = {key: relationship.get(key, "") for key in required_relationship_keys}
+        normalized_relationship = {
+            key: "" if relationship.get(key) is None else relationship[key] for key in required_relationship_keys
+        }
         normalized_relationships.append(normalized_relationship)
 
     return {"entities": normalized_entities, "relationships": normalized_relationships}
 
 
-# GPT-4 entity and relationship extraction
-def extract_entities_relationships_from_chunks(chunks):
+# GPT-4 entity and relationship extraction for one chunk
+def extract_chunk(client, chunk, max_retries=EXTRACTION_MAX_RETRIES, backoff=EXTRACTION_BACKOFF):
+    """
+    Return the normalized entities and relationships of one chunk, or None
+    when the response is not valid JSON. Rate limits, connection and server
+    errors are retried with exponential backoff and jitter.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            response = client.chat.completions.create(
+                model=EXTRACTION_MODEL,
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": chunk},
+                ]
+            )
+            break
+        except _RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            delay = backoff * 2 ** attempt * (1 + random.random())
+            print(f"{type(e).__name__}, retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+    structured_data = clean_and_parse_response(response.choices[0].message.content)
+    if structured_data is None:
+        return None
+    return normalize_data(structured_data)
+
+
+def extract_entities_relationships_from_chunks(chunks, max_concurrency=EXTRACTION_MAX_CONCURRENCY,
+                                               max_retries=EXTRACTION_MAX_RETRIES, backoff=EXTRACTION_BACKOFF,
+                                               client=None, cache_path=EXTRACTION_CACHE_PATH, resolve=True,
+                                               match_threshold=ENTITY_MATCH_THRESHOLD):
+    """
+    Extract entities and relationships from all chunks with up to
+    max_concurrency requests in flight. Results are merged in chunk order,
+    so the output does not depend on which request finishes first.
+
+    Each parsed chunk result is appended to the JSONL file at cache_path as
+    soon as it arrives, and chunks already in that file are not sent again,
+    so an interrupted run resumes where it stopped and an unchanged input
+    makes no API calls. Chunks whose response could not be parsed are not
+    cached and are retried on the next run.
+
+    With resolve, the chunk results are merged by resolve_entities;
+    otherwise they are concatenated as returned by the LLM.
+    """
+    cache = load_extraction_cache(cache_path)
+    keys = [chunk_key(chunk) for chunk in chunks]
+    pending = [i for i, key in enumerate(keys) if key not in cache]
+    print(f"{len(chunks) - len(pending)}/{len(chunks)} chunks found in the extraction cache.")
+
     all_entities = []
     all_relationships = []
+    done = 0
+    lock = threading.Lock()
+    start = time.perf_counter()
+
+    if pending:
+        client = client or get_client()
+        if cache_path:
+            os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        checkpoint = open(cache_path, "a", encoding="utf-8") if cache_path else None
+
+        def extract(i):
+            nonlocal done
+            result = extract_chunk(client, chunks[i], max_retries, backoff)
+            with lock:
+                done += 1
+                print(f"Processed chunk {done}/{len(pending)}...")
+                if result is not None:
+                    cache[keys[i]] = result
+                    if checkpoint:
+                        checkpoint.write(json.dumps({"key": keys[i], "chunk": i, "result": result}) + "\n")
+                        checkpoint.flush()
+
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+                list(executor.map(extract, pending))
+        finally:
+            if checkpoint:
+                checkpoint.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Extracted {len(pending)} chunks in {elapsed:.1f}s ({len(pending) / max(elapsed, 1e-9):.2f} chunks/sec)")
+
+    if resolve:
+        return resolve_entities([cache.get(key) for key in keys], match_threshold=match_threshold)
 
-    for i, chunk in enumerate(chunks):
-        print(f"Processing chunk {i + 1}/{len(chunks)}...")
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages = [
-                {
-                    "role": "system",
-                    "content": (
-                        "Extract entities and relationships in JSON format to store them in a Neo4j database. "
-                        "Return the response in the following structure. The keys should be present in the entities and relationships:\n\n"
-                        "{\n"
-                        '  "entities": [\n'
-                        '    { "id": "1", "name": "India", "type": "Country", "description": "A country in South Asia." },\n'
-                        '    { "id": "2", "name": "Pandemic", "type": "Event", "description": "Global outbreak of a disease." }\n'
-                        "  ],\n"
-                        '  "relationships": [\n'
-                        '    { "from": "1", "to": "2", "type": "affected_by", "context": "Economic impact due to the pandemic" }\n'
-                        "  ]\n"
-                        "}\n\n"
-                        "Make sure to store longer sentences in the description and context fields so that meaningful answers can be retrieved."
-                    ),
-                },
-                {"role": "user", "content": chunk},
-            ]
-        )
-
-        response_content = response.choices[0].message.content
-        structured_data = clean_and_parse_response(response_content)
-
-        if structured_data is not None:
-            normalized_data = normalize_data(structured_data)
+    for key in keys:
+        normalized_data = cache.get(key)
+        if normalized_data is not None:
             all_entities.extend(normalized_data["entities"])
             all_relationships.extend(normalized_data["relationships"])
-
     return {"entities": all_entities, "relationships": all_relationships}
 
+
+def normalize_name(text):
+    """Lowercase, drop punctuation and collapse whitespace."""
+    return " ".join(re.sub(r"[^\w\s]", " ", str(text).lower()).split())
+
+
+def entity_id(name, entity_type):
+    """Content-derived id, stable across runs and chunkings."""
+    key = f"{normalize_name(name)}\0{normalize_name(entity_type)}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def _name_vectors(names, model=None):
+    """Unit-length name embeddings, read through EmbeddingCache so a re-run embeds nothing new."""
+    from scripts.embedding_cache import EmbeddingCache
+    from scripts.embeddings import get_embedding_model
+
+    cache = EmbeddingCache(model or get_embedding_model())
+    try:
+        vectors = cache.embed(names)
+    finally:
+        cache.close()
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def _fuzzy_groups(names, types, threshold, model=None, top_k=ENTITY_MATCH_TOP_K,
+                  max_block_size=ENTITY_BLOCK_MAX_SIZE):
+    """
+    Union-find parents over names, linking similar names of the same type.
+
+    Blocking keeps this near-linear: only names of one type sharing a name
+    token are compared, tokens shared by more than max_block_size names are
+    not used, and each name keeps its top_k most similar candidates at or
+    above threshold. Names are only paired when they contain the same
+    numeric tokens, so "fiscal deficit fy23" never merges with "fiscal
+    deficit fy24" however close their embeddings are. Candidates are
+    merged most similar first, and two clusters only when every name of
+    one is at least threshold similar to every name of the other, so a
+    chain A~B~C cannot pull an unrelated C in with A.
+    """
+    parent = list(range(len(names)))
+    numbers = [frozenset(token for token in name.split() if any(c.isdigit() for c in token)) for name in names]
+    blocks = {}
+    for i, (name, entity_type) in enumerate(zip(names, types)):
+        for token in set(name.split()):
+            blocks.setdefault((entity_type, token), []).append(i)
+    blocks = [members for members in blocks.values() if 2 <= len(members) <= max_block_size]
+    if not blocks:
+        return parent
+
+    # Only names in some block are ever compared, so only those are embedded.
+    needed = sorted({i for members in blocks for i in members})
+    row_of = {i: row for row, i in enumerate(needed)}
+    vectors = _name_vectors([names[i] for i in needed], model)
+
+    neighbours = {}  # i -> {j: similarity}
+    for members in blocks:
+        block = vectors[[row_of[i] for i in members]]
+        similarities = block @ block.T
+        for row, col in zip(*np.nonzero(similarities >= threshold)):
+            if row != col and numbers[members[row]] == numbers[members[col]]:
+                neighbours.setdefault(members[row], {})[members[col]] = float(similarities[row, col])
+
+    pairs = {}
+    for i, candidates in neighbours.items():
+        for j, similarity in sorted(candidates.items(), key=lambda item: -item[1])[:top_k]:
+            pairs[(min(i, j), max(i, j))] = similarity
+
+    clusters = {i: [row_of[i]] for i in needed}  # root -> vector rows of its names
+    for (i, j), _ in sorted(pairs.items(), key=lambda item: -item[1]):
+        a, b = _find(parent, i), _find(parent, j)
+        if a == b or (vectors[clusters[a]] @ vectors[clusters[b]].T).min() < threshold:
+            continue
+        root, child = min(a, b), max(a, b)
+        parent[child] = root
+        clusters[root].extend(clusters.pop(child))
+    return parent
+
+
+def resolve_entities(chunk_results, match_threshold=ENTITY_MATCH_THRESHOLD, model=None):
+    """
+    Merge per-chunk results into one graph.
+
+    LLM ids restart at "1" in every chunk, so ids are first namespaced by
+    chunk. Entities with the same normalized name and type are then one
+    entity, and with match_threshold > 0 names of the same type whose
+    embeddings are that similar are merged as well. Each merged entity
+    gets a stable id, keeps the longest description and counts its
+    mentions. Relationship endpoints are remapped to the merged ids;
+    relationships pointing at unknown ids or collapsing into self-loops are
+    dropped, and repeated edges are counted instead of duplicated.
+    """
+    groups = {}  # (normalized name, normalized type) -> mentions of that entity
+    local_ids = {}  # (chunk index, LLM id) -> group key
+    for chunk_index, result in enumerate(chunk_results):
+        for entity in (result or {}).get("entities", []):
+            key = (normalize_name(entity["name"]), normalize_name(entity["type"]))
+            if not key[0]:
+                continue
+            groups.setdefault(key, []).append(entity)
+            local_ids[(chunk_index, str(entity["id"]))] = key
+
+    keys = list(groups)
+    canonical = {key: key for key in keys}
+    if match_threshold > 0 and len(keys) > 1:
+        parent = _fuzzy_groups([key[0] for key in keys], [key[1] for key in keys], match_threshold, model)
+        for i, key in enumerate(keys):
+            canonical[key] = keys[_find(parent, i)]
+
+    merged = {}
+    for key in keys:
+        root = canonical[key]
+        merged.setdefault(root, []).extend(groups[key])
+
+    entities = []
+    ids = {}
+    for root, mentions in merged.items():
+        name = Counter(str(entity["name"]).strip() for entity in mentions).most_common(1)[0][0]
+        entity_type = Counter(entity["type"] for entity in mentions).most_common(1)[0][0]
+        ids[root] = entity_id(name, entity_type)
+        entities.append({
+            "id": ids[root],
+            "name": name,
+            "type": entity_type,
+            "description": max((entity["description"] for entity in mentions), key=len),
+            "mentions": len(mentions),
+        })
+
+    edges = {}
+    dropped = 0
+    for chunk_index, result in enumerate(chunk_results):
+        for relationship in (result or {}).get("relationships", []):
+            source = local_ids.get((chunk_index, str(relationship["from"])))
+            target = local_ids.get((chunk_index, str(relationship["to"])))
+            if source is None or target is None or canonical[source] == canonical[target]:
+                dropped += 1
+                continue
+            edge = (ids[canonical[source]], ids[canonical[target]], relationship["type"])
+            if edge in edges:
+                edges[edge]["mentions"] += 1
+            else:
+                edges[edge] = {**relationship, "from": edge[0], "to": edge[1], "mentions": 1}
+
+    print(f"Resolved {len(local_ids)} entity mentions into {len(entities)} entities "
+          f"and {len(edges)} relationships ({dropped} dangling or self-referencing dropped)")
+    return {"entities": entities, "relationships": list(edges.values())}
+
 if __name__ == "__main__":
     input_txt_file = "/Users/mukeshsihag/Desktop/nlp/backend1/data/raw_text.txt"
-    output_json_file = "/Users/mukeshsihag/Desktop/nlp/backend1/data/structured_data.json"
+    output_json_file = "/Users/mukeshsihag/Desktop/nlp/backend1/data/structured_data.jsonl"
 
     with open(input_txt_file, "r", encoding="utf-8") as f:
         raw_text = f.read()
@@ -117,7 +438,8 @@ if __name__ == "__main__":
     print("Extracting entities and relationships from chunks...")
     structured_data = extract_entities_relationships_from_chunks(chunks)
 
-    with open(output_json_file, "w", encoding="utf-8") as f:
-        json.dump(structured_data, f, indent=4)
+    # One entity or relationship per line, streamed by create_graph_db
+    write_structured_jsonl(output_json_file, structured_records(structured_data["entities"],
+                                                                structured_data["relationships"]))
 
     print(f"Entities and relationships extracted and saved to {output_json_file}")
@@ -0,0 +1,327 @@
+import hashlib
+import os
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import namedtuple
+
+import numpy as np
+from dotenv import load_dotenv
+from scripts.structured_io import iter_structured_data
+
+load_dotenv()
+
+# "neo4j" (a Neo4j server over Bolt) or "memory" (GRAPH_DATA_PATH loaded into this process)
+GRAPH_BACKEND = os.getenv("GRAPH_BACKEND", "neo4j")
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+# Structured data file (.jsonl or .json) the memory backend serves; reloaded when it changes.
+# Defaults to data/structured_data.jsonl, or the shipped data/structured_data.json while that does not exist.
+GRAPH_DATA_PATH = os.getenv("GRAPH_DATA_PATH") or os.path.join(
+    DATA_DIR,
+    "structured_data.jsonl" if os.path.exists(os.path.join(DATA_DIR, "structured_data.jsonl")) else "structured_data.json",
+)
+
+NEO4J_URL = os.getenv("NEO4J_URL", "bolt://localhost:7689")
+NEO4J_USERNAME = os.getenv("NEO4J_USERNAME", "neo4j")
+NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "12345678")
+
+GRAPH_BACKENDS = ("neo4j", "memory")
+
+
+class GraphStore(ABC):
+    """
+    What the RAG pipelines and the loader need from a graph.
+
+    Nodes are addressed by integer ids (usable as FAISS ids). Node details
+    are dicts with id, description, name, type and relationships, a list
+    of {"relation", "target"} dicts for the outgoing edges.
+    """
+
+    @abstractmethod
+    def load(self, entities, relationships):
+        """Upsert entities, then relationships between them, by their "id" / "from" and "to" fields."""
+
+    @abstractmethod
+    def stamp(self):
+        """(nodes, relationships, last update) tuple that changes whenever the graph does."""
+
+    @abstractmethod
+    def node_texts(self):
+        """(id, text) of every node with text, text being the description or else the name."""
+
+    @abstractmethod
+    def node_details(self, node_ids, max_relationships=None):
+        """Details of node_ids, in that order; ids that do not exist are skipped."""
+
+    @abstractmethod
+    def iter_node_details(self, max_relationships=None):
+        """Details of every node with text."""
+
+
+class Neo4jGraphStore(GraphStore):
+    """The graph in Neo4j, connected to on first use so importing it never needs the database."""
+
+    def __init__(self, url=NEO4J_URL, username=NEO4J_USERNAME, password=NEO4J_PASSWORD):
+        self.url = url
+        self.username = username
+        self.password = password
+        self._graph = None
+        self._lock = threading.Lock()
+
+    def query(self, cypher_query, params=None):
+        with self._lock:
+            if self._graph is None:
+                from langchain_neo4j import Neo4jGraph
+                self._graph = Neo4jGraph(url=self.url, username=self.username, password=self.password)
+        return self._graph.query(cypher_query, params or {})
+
+    def load(self, entities, relationships):
+        from scripts.create_graph_db import (
+            create_constraints, get_neo4j_driver, store_entities_bulk, store_relationships_bulk,
+        )
+        driver = get_neo4j_driver(self.url, self.username, self.password)
+        try:
+            create_constraints(driver)
+            print("Storing entities...")
+            store_entities_bulk(driver, entities)
+            print("Storing relationships...")
+            store_relationships_bulk(driver, relationships)
+        finally:
+            driver.close()
+
+    def stamp(self):
+        """
+        Node and relationship counts (answered from Neo4j's count store) and
+        the newest Entity.updated_at written by the loader, read from the end
+        of the entity_updated_at index, so polling never scans the graph.
+        """
+        counts = self.query("""
+        CALL { MATCH (n) RETURN count(n) AS nodes }
+        CALL { MATCH ()-[r]->() RETURN count(r) AS relationships }
+        RETURN nodes, relationships
+        """)[0]
+        latest = self.query("""
+        MATCH (e:Entity) WHERE e.updated_at IS NOT NULL
+        RETURN e.updated_at AS updated_at
+        ORDER BY e.updated_at DESC
+        LIMIT 1
+        """)
+        return counts["nodes"], counts["relationships"], latest[0]["updated_at"] if latest else None
+
+    def node_texts(self):
+        results = self.query("""
+        MATCH (n)
+        RETURN id(n) AS id, COALESCE(n.description, n.name) AS text
+        """)
+        return [(record["id"], record["text"]) for record in results if record["text"]]
+
+    @staticmethod
+    def _relationships(max_relationships):
+        relationships = "[(n)-[r]->(m) | {relation: COALESCE(r.type, type(r)), target: m.name}]"
+        return relationships if max_relationships is None else f"{relationships}[..$max_relationships]"
+
+    def node_details(self, node_ids, max_relationships=None):
+        if not node_ids:
+            return []
+        results = self.query(f"""
+        UNWIND range(0, size($node_ids) - 1) AS rank
+        MATCH (n) WHERE id(n) = $node_ids[rank]
+        RETURN rank, id(n) AS id, n.description AS description, n.name AS name, n.type AS type,
+               {self._relationships(max_relationships)} AS relationships
+        ORDER BY rank
+        """, {"node_ids": list(node_ids), "max_relationships": max_relationships})
+        return [_details(record) for record in results]
+
+    def iter_node_details(self, max_relationships=None):
+        results = self.query(f"""
+        MATCH (n)
+        WHERE COALESCE(n.description, n.name) IS NOT NULL
+        RETURN id(n) AS id, n.description AS description, n.name AS name, n.type AS type,
+               {self._relationships(max_relationships)} AS relationships
+        """, {"max_relationships": max_relationships})
+        for record in results:
+            yield _details(record)
+
+
+def _details(record):
+    return {
+        "id": record.get("id"),
+        "description": record.get("description"),
+        "name": record.get("name"),
+        "type": record.get("type"),
+        "relationships": record.get("relationships") or []
+    }
+
+
+def node_id(entity_id):
+    """Integer node id of an entity id: stable across loads and processes, and a valid FAISS id."""
+    return int.from_bytes(hashlib.sha1(str(entity_id).encode("utf-8")).digest()[:8], "big") >> 1
+
+
+# One loaded graph. Node attributes are lists indexed by row; the outgoing
+# edges of row i are targets[offsets[i]:offsets[i + 1]] (CSR), with
+# relation_names[relations[j]] the type of edge j. Never mutated: a reload
+# builds a new one, so readers holding the old one stay consistent.
+CSRGraph = namedtuple("CSRGraph", [
+    "node_ids", "rows", "names", "descriptions", "types",
+    "offsets", "targets", "relations", "relation_names", "updated_at",
+])
+
+
+class InMemoryGraphStore(GraphStore):
+    """
+    The graph held in this process as CSR adjacency arrays, for tests,
+    benchmarks and small deployments without a database. Given a path it
+    loads that structured data file on first use and again whenever the
+    file's modification time changes (checked by stamp(), which the index
+    refresh polls).
+
+    load() has the loader's MERGE semantics: a repeated entity id
+    overwrites the earlier record, a repeated (from, to, type) edge is kept
+    once, and edges to unknown entities are dropped.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._graph = None
+        self._lock = threading.Lock()
+
+    def load(self, entities, relationships):
+        start = time.perf_counter()
+        rows = {}
+        names, descriptions, types = [], [], []
+        for entity in entities:
+            row = rows.setdefault(entity["id"], len(rows))
+            if row == len(names):
+                names.append(None)
+                descriptions.append(None)
+                types.append(None)
+            names[row] = entity.get("name")
+            descriptions[row] = entity.get("description")
+            types[row] = entity.get("type")
+
+        edges = {}
+        relation_codes = {}
+        dropped = 0
+        for relationship in relationships:
+            source = rows.get(relationship["from"])
+            target = rows.get(relationship["to"])
+            if source is None or target is None:
+                dropped += 1
+                continue
+            relation = relation_codes.setdefault(relationship["type"], len(relation_codes))
+            edges.setdefault((source, target, relation), None)
+
+        edge_array = np.array(list(edges), dtype=np.int64).reshape(-1, 3)
+        order = np.argsort(edge_array[:, 0], kind="stable")
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(edge_array[:, 0], minlength=len(rows)), out=offsets[1:])
+
+        node_ids = [node_id(entity_id) for entity_id in rows]
+        self._graph = CSRGraph(
+            node_ids=node_ids,
+            rows={node: row for row, node in enumerate(node_ids)},
+            names=names,
+            descriptions=descriptions,
+            types=types,
+            offsets=offsets,
+            targets=edge_array[order, 1].astype(np.int32),
+            relations=edge_array[order, 2].astype(np.int32),
+            relation_names=list(relation_codes),
+            updated_at=time.time(),
+        )
+        elapsed = time.perf_counter() - start
+        print(f"Loaded {len(rows)} entities and {len(edges)} relationships into memory in {elapsed:.2f}s"
+              + (f" ({dropped} relationships to unknown entities dropped)" if dropped else ""))
+
+    def load_file(self, path):
+        """Load a structured data file, reading it once per kind like the Neo4j loader."""
+        updated_at = os.path.getmtime(path)
+        self.load(iter_structured_data(path, "entity"), iter_structured_data(path, "relationship"))
+        self._graph = self._graph._replace(updated_at=updated_at)
+
+    def _current(self, check_file=False):
+        graph = self._graph
+        if self.path and (graph is None or (check_file and os.path.getmtime(self.path) != graph.updated_at)):
+            with self._lock:
+                graph = self._graph
+                if graph is None or os.path.getmtime(self.path) != graph.updated_at:
+                    self.load_file(self.path)
+                    graph = self._graph
+        if graph is None:
+            raise RuntimeError("In-memory graph store is empty: give it a path or call load()")
+        return graph
+
+    def stamp(self):
+        graph = self._current(check_file=True)
+        return len(graph.node_ids), len(graph.targets), graph.updated_at
+
+    @staticmethod
+    def _text(graph, row):
+        description = graph.descriptions[row]
+        return description if description is not None else graph.names[row]
+
+    def node_texts(self):
+        graph = self._current()
+        return [(graph.node_ids[row], text) for row in range(len(graph.node_ids))
+                if (text := self._text(graph, row))]
+
+    @staticmethod
+    def _details(graph, row, max_relationships):
+        start, end = graph.offsets[row], graph.offsets[row + 1]
+        if max_relationships is not None:
+            end = min(end, start + max_relationships)
+        return {
+            "id": graph.node_ids[row],
+            "description": graph.descriptions[row],
+            "name": graph.names[row],
+            "type": graph.types[row],
+            "relationships": [
+                {"relation": graph.relation_names[relation], "target": graph.names[target]}
+                for target, relation in zip(graph.targets[start:end].tolist(), graph.relations[start:end].tolist())
+            ]
+        }
+
+    def node_details(self, node_ids, max_relationships=None):
+        graph = self._current()
+        rows = (graph.rows.get(node) for node in node_ids)
+        return [self._details(graph, row, max_relationships) for row in rows if row is not None]
+
+    def iter_node_details(self, max_relationships=None):
+        graph = self._current()
+        for row in range(len(graph.node_ids)):
+            if self._text(graph, row):
+                yield self._details(graph, row, max_relationships)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_graph_store(backend=GRAPH_BACKEND):
+    """The shared store of a backend ("neo4j" or "memory"), GRAPH_BACKEND by default."""
+    if backend not in GRAPH_BACKENDS:
+        raise ValueError(f"Unknown graph backend {backend!r}, expected one of {GRAPH_BACKENDS}")
+    with _stores_lock:
+        if backend not in _stores:
+            _stores[backend] = Neo4jGraphStore() if backend == "neo4j" else InMemoryGraphStore(GRAPH_DATA_PATH)
+        return _stores[backend]
+
+
+def benchmark_lookups(store, lookups=10000, top_k=3):
+    """Print the mean latency of a node_details call for top_k random nodes."""
+    ids = np.array([node for node, _ in store.node_texts()], dtype=np.int64)
+    rng = np.random.default_rng(0)
+    batches = ids[rng.integers(0, len(ids), size=(lookups, top_k))].tolist()
+    start = time.perf_counter()
+    for batch in batches:
+        store.node_details(batch)
+    elapsed = time.perf_counter() - start
+    print(f"{type(store).__name__}: {len(ids)} nodes, {elapsed / lookups * 1e6:.1f} us per {top_k}-node lookup")
+
+
+if __name__ == "__main__":
+    # Usage: python -m scripts.graph_store [neo4j|memory] [lookups]
+    benchmark_lookups(get_graph_store(sys.argv[1] if len(sys.argv) > 1 else GRAPH_BACKEND),
+                      int(sys.argv[2]) if len(sys.argv) > 2 else 10000)
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+
+import faiss
+import numpy as np
+
+INDEX_SNAPSHOT_DIR = os.getenv(
+    "INDEX_SNAPSHOT_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "index"),
+)
+
+# Bumped whenever the snapshot layout changes; older snapshots are ignored.
+SNAPSHOT_FORMAT = 2
+
+_INDEX_FILE = "index.faiss"
+_VECTORS_FILE = "vectors.npy"
+_META_FILE = "meta.json"
+_CONTEXTS_FILE = "contexts.json"
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def save_snapshot(faiss_index, vectors, node_ids, hashes, model_name, index_type="flat",
+                  snapshot_dir=INDEX_SNAPSHOT_DIR, contexts=None):
+    """
+    Write the FAISS index (an IndexIDMap2 keyed by node id), its vectors and
+    the node id and text hash of each vector row to snapshot_dir, along with
+    the precomputed LLM context string of each node ({node id: context})
+    when contexts is given.
+
+    Files are written under temporary names and renamed into place, with the
+    metadata last, so a crash never leaves a half-written snapshot behind.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    meta = {
+        "format": SNAPSHOT_FORMAT,
+        "model": model_name,
+        "index_type": index_type,
+        "dim": int(vectors.shape[1]) if vectors.ndim == 2 else 0,
+        "node_ids": list(node_ids),
+        "hashes": list(hashes),
+    }
+
+    index_tmp = os.path.join(snapshot_dir, _INDEX_FILE + ".tmp")
+    faiss.write_index(faiss_index, index_tmp)
+    os.replace(index_tmp, os.path.join(snapshot_dir, _INDEX_FILE))
+
+    vectors_tmp = os.path.join(snapshot_dir, _VECTORS_FILE + ".tmp")
+    with open(vectors_tmp, "wb") as f:
+        np.save(f, np.ascontiguousarray(vectors, dtype="float32"))
+    os.replace(vectors_tmp, os.path.join(snapshot_dir, _VECTORS_FILE))
+
+    if contexts is not None:
+        contexts_tmp = os.path.join(snapshot_dir, _CONTEXTS_FILE + ".tmp")
+        with open(contexts_tmp, "w", encoding="utf-8") as f:
+            json.dump([[node_id, context] for node_id, context in contexts.items()], f, separators=(",", ":"))
+        os.replace(contexts_tmp, os.path.join(snapshot_dir, _CONTEXTS_FILE))
+
+    meta_tmp = os.path.join(snapshot_dir, _META_FILE + ".tmp")
+    with open(meta_tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(meta_tmp, os.path.join(snapshot_dir, _META_FILE))
+
+
+def load_snapshot(model_name, snapshot_dir=INDEX_SNAPSHOT_DIR):
+    """
+    Load a snapshot written by save_snapshot.
+
+    Returns None if there is no usable snapshot, or if it was built with a
+    different embedding model. "contexts" is None for snapshots saved
+    without node contexts.
+    """
+    meta_path = os.path.join(snapshot_dir, _META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format") != SNAPSHOT_FORMAT or meta.get("model") != model_name:
+            return None
+        vectors = np.load(os.path.join(snapshot_dir, _VECTORS_FILE))
+        faiss_index = faiss.read_index(os.path.join(snapshot_dir, _INDEX_FILE))
+        contexts = None
+        contexts_path = os.path.join(snapshot_dir, _CONTEXTS_FILE)
+        if os.path.exists(contexts_path):
+            with open(contexts_path, "r", encoding="utf-8") as f:
+                contexts = {node_id: context for node_id, context in json.load(f)}
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"Ignoring unreadable index snapshot in {snapshot_dir}: {e}")
+        return None
+
+    if len(vectors) != len(meta["node_ids"]) or faiss_index.ntotal != len(vectors):
+        print(f"Ignoring inconsistent index snapshot in {snapshot_dir}")
+        return None
+
+    return {
+        "index": faiss_index,
+        "index_type": meta.get("index_type", "flat"),
+        "vectors": vectors,
+        "node_ids": meta["node_ids"],
+        "hashes": meta["hashes"],
+        "contexts": contexts,
+    }
@@ -1,10 +1,31 @@
+import asyncio
 import os
-from langchain_openai import ChatOpenAI
-from langchain_neo4j import Neo4jGraph
-from langchain.embeddings import OpenAIEmbeddings
+import threading
+import time
+from collections import namedtuple
 import numpy as np
 import faiss
 from dotenv import load_dotenv
+from scripts.ann_index import (
+    FAISS_EF_SEARCH,
+    FAISS_INDEX_TYPE,
+    FAISS_NPROBE,
+    build_index,
+    set_search_params,
+    supports_remove,
+)
+from scripts.answer_cache import NO_ANSWER
+from scripts.embeddings import (
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_MAX_CONCURRENCY,
+    embed_texts,
+    embedding_model_name,
+    get_embedding_model,
+    iter_embedding_batches,
+)
+from scripts.graph_store import get_graph_store
+from scripts.index_store import load_snapshot, save_snapshot, text_hash
+from scripts.llm import agenerate_responses, astream_responses, contexts_for_mode, generate_responses
 import warnings
 import logging as py_logging
 
@@ -19,90 +40,331 @@ os.environ["TOKENIZERS_PARALLELISM"] = "false"
 # OpenAI API key
 openai_api_key = os.getenv("OPENAI_API_KEY")
 
-neo4j_url = "bolt://localhost:7689"
-neo4j_username = "neo4j"
-neo4j_password = "12345678"
+# Where query-time contexts come from: "store" (materialized at index build
+# time, no graph round trip; nodes missing from it fall back to the graph) or
+# "graph" (fetched from the graph store on every query).
+LAZY_RAG_CONTEXT_SOURCE = os.getenv("LAZY_RAG_CONTEXT_SOURCE", "store")
+# Relationships kept per node in a materialized context
+CONTEXT_MAX_RELATIONSHIPS = int(os.getenv("CONTEXT_MAX_RELATIONSHIPS", "25"))
+
+embedding_model = get_embedding_model()
+embedding_dim = 1536
+
+# Rebuild the index from scratch (retraining IVF centroids) instead of
+# patching it when more than this fraction of the nodes changed.
+INDEX_REBUILD_FRACTION = float(os.getenv("INDEX_REBUILD_FRACTION", "0.2"))
 
-graph = Neo4jGraph(
-    url=neo4j_url,
-    username=neo4j_username,
-    password=neo4j_password
+# The FAISS index (an IndexIDMap2 keyed by graph node id) together with the
+# vector, node id and text hash of every indexed node and the LLM context
+# string of every node ({node id: context}). A state is never
+# mutated: updates build a new one and rebind _state, so a query that has
+# read _state keeps searching a consistent index while a refresh runs.
+IndexState = namedtuple("IndexState", ["index", "vectors", "node_ids", "hashes", "index_type", "contexts", "version"])
+
+_state = IndexState(
+    index=build_index(np.empty((0, embedding_dim), dtype="float32"), index_type="flat", ids=[]),
+    vectors=np.empty((0, embedding_dim), dtype="float32"),
+    node_ids=[],
+    hashes=[],
+    index_type="flat",
+    contexts={},
+    version=None,
 )
+_refresh_lock = threading.Lock()
+_graph_stamp = None
 
-embedding_model = OpenAIEmbeddings(openai_api_key=openai_api_key)
-embedding_dim = 1536
-faiss_index = faiss.IndexFlatL2(embedding_dim)
-index_map = {} 
-
-
-def load_embeddings():
-    """Precompute embeddings and store in FAISS index."""
-    global faiss_index, index_map
-    cypher_query = """
-    MATCH (n)
-    RETURN id(n) AS id, COALESCE(n.description, n.name) AS text
-    """
-    results = graph.query(cypher_query)
-
-    for record in results:
-        node_id = record["id"]
-        text = record["text"]
-        if not text:
-            continue
-        embedding = embedding_model.embed_query(text)  
-        faiss_index.add(np.array([embedding]).astype("float32")) 
-        index_map[len(index_map)] = node_id
-
-def search_embeddings(query, top_k=3):
-    query_embedding = np.array(embedding_model.embed_query(query)).astype("float32")
-    distances, indices = faiss_index.search(np.array([query_embedding]), top_k)
+
+def current_index_version():
+    """Changes whenever the indexed nodes or their texts change."""
+    return _state.version
+
+def graph_stamp():
+    """
+    Cheap change detector for the graph: the node and relationship counts
+    (catch deletions and new edges) and when it was last written.
+    """
+    return get_graph_store().stamp()
+
+def _fetch_nodes():
+    return get_graph_store().node_texts()
+
+def _fetch_contexts(max_relationships=CONTEXT_MAX_RELATIONSHIPS):
+    """The build_context string of every node with text, relationships capped at max_relationships."""
+    return {details["id"]: build_context(details)
+            for details in get_graph_store().iter_node_details(max_relationships)}
+
+def _state_version(state):
+    """Changes whenever the indexed nodes, their texts or their contexts change."""
+    model_name = embedding_model_name(embedding_model)
+    nodes = ",".join(f"{i}:{h}" for i, h in zip(state.node_ids, state.hashes))
+    contexts = ",".join(f"{i}:{text_hash(c)}" for i, c in sorted(state.contexts.items()))
+    return text_hash(f"{model_name}:{state.index_type}:{nodes}|{contexts}")
+
+def _apply_changes(state, nodes, index_type, batch_size, max_concurrency):
+    """
+    Return a new IndexState for nodes, built from state.
+
+    Nodes whose text hash is unknown are embedded; all other vectors are
+    reused. Deleted and changed nodes are removed from a copy of the index by
+    id and new and changed ones added, unless the index type cannot remove
+    rows or too much changed, in which case the index is rebuilt from the
+    vectors. Returns (new_state, stats); new_state shares state's index if
+    nothing changed. The caller sets contexts and version.
+    """
+    node_ids = [node_id for node_id, _ in nodes]
+    hashes = [text_hash(text) for _, text in nodes]
+
+    old_hashes = dict(zip(state.node_ids, state.hashes))
+    added = [i for i, node_id in enumerate(node_ids) if node_id not in old_hashes]
+    updated = [i for i, node_id in enumerate(node_ids)
+               if node_id in old_hashes and old_hashes[node_id] != hashes[i]]
+    current_ids = set(node_ids)
+    removed = [node_id for node_id in state.node_ids if node_id not in current_ids]
+    stats = {"added": len(added), "updated": len(updated), "removed": len(removed), "embedded": 0}
+    if not (added or updated or removed) and state.index_type == index_type:
+        return state, stats
+
+    rows_by_hash = {h: row for row, h in enumerate(state.hashes)}
+    vectors = np.empty((len(nodes), state.vectors.shape[1]), dtype="float32")
+    missing = []
+    for i, h in enumerate(hashes):
+        if h in rows_by_hash:
+            vectors[i] = state.vectors[rows_by_hash[h]]
+        else:
+            missing.append(i)
+
+    missing_texts = [nodes[i][1] for i in missing]
+    for start, batch in iter_embedding_batches(missing_texts, embedding_model, batch_size, max_concurrency):
+        vectors[missing[start:start + len(batch)]] = batch
+    stats["embedded"] = len(missing)
+
+    changed = len(added) + len(updated) + len(removed)
+    if (state.index_type == index_type and supports_remove(index_type) and state.node_ids
+            and changed <= INDEX_REBUILD_FRACTION * len(state.node_ids)):
+        index = faiss.clone_index(state.index)
+        stale_ids = removed + [node_ids[i] for i in updated]
+        if stale_ids:
+            index.remove_ids(np.array(stale_ids, dtype="int64"))
+        fresh = added + updated
+        if fresh:
+            index.add_with_ids(vectors[fresh], np.array([node_ids[i] for i in fresh], dtype="int64"))
+        set_search_params(index, nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH)
+    else:
+        index = build_index(vectors, index_type=index_type, ids=node_ids)
+
+    return IndexState(index, vectors, node_ids, hashes, index_type, state.contexts, None), stats
+
+def _update_state(state, batch_size, max_concurrency, index_type):
+    """Bring state in line with the graph, swap it in and persist it. Caller holds _refresh_lock."""
+    global _state, _graph_stamp
+    stamp = graph_stamp()
+    new_state, stats = _apply_changes(state, _fetch_nodes(), index_type, batch_size, max_concurrency)
+    new_state = new_state._replace(contexts=_fetch_contexts())
+    new_state = new_state._replace(version=_state_version(new_state))
+    _state = new_state
+    _graph_stamp = stamp
+    if new_state.index is not state.index or new_state.contexts != state.contexts:
+        save_snapshot(new_state.index, new_state.vectors, new_state.node_ids, new_state.hashes,
+                      embedding_model_name(embedding_model), index_type, contexts=new_state.contexts)
+    return stats
+
+def load_embeddings(batch_size=EMBEDDING_BATCH_SIZE, max_concurrency=EMBEDDING_MAX_CONCURRENCY,
+                    use_snapshot=True, index_type=FAISS_INDEX_TYPE):
+    """
+    Precompute embeddings and store in FAISS index.
+
+    The index is persisted to INDEX_SNAPSHOT_DIR together with a hash of each
+    node's text. On the next call the snapshot is reused and only nodes whose
+    text is new or changed are embedded, in batches of batch_size with at most
+    max_concurrency requests in flight.
+
+    index_type selects the FAISS index ("flat", "ivf_flat", "ivf_pq" or
+    "hnsw"); IVF indexes are trained on the loaded vectors.
+
+    Each node's context is materialized next to the vectors. If the graph
+    cannot be reached but a snapshot with contexts exists, the snapshot is
+    served as is and the graph is picked up by a later refresh.
+    """
+    global _state
+    model_name = embedding_model_name(embedding_model)
+    with _refresh_lock:
+        snapshot = load_snapshot(model_name) if use_snapshot else None
+        state = _state
+        if snapshot:
+            set_search_params(snapshot["index"], nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH)
+            state = IndexState(snapshot["index"], snapshot["vectors"], snapshot["node_ids"],
+                               snapshot["hashes"], snapshot["index_type"], snapshot["contexts"] or {}, None)
+        try:
+            stats = _update_state(state, batch_size, max_concurrency, index_type)
+        except Exception as e:
+            if not (snapshot and snapshot["contexts"]):
+                raise
+            print(f"Graph unavailable ({e}); serving the index snapshot without the graph.")
+            _state = state._replace(version=_state_version(state))
+            stats = {"added": 0, "updated": 0, "removed": 0, "embedded": 0}
+
+    print(f"Indexed {len(_state.node_ids)} nodes: {stats['added']} added, {stats['updated']} updated, "
+          f"{stats['removed']} removed, {stats['embedded']} embedded.")
+
+def refresh_embeddings(batch_size=EMBEDDING_BATCH_SIZE, max_concurrency=EMBEDDING_MAX_CONCURRENCY,
+                       index_type=FAISS_INDEX_TYPE):
+    """
+    Incrementally update the live index from the graph and swap it in
+    atomically; in-flight queries finish on the index they started with.
+    Returns counts of added, updated, removed and embedded nodes.
+    """
+    with _refresh_lock:
+        return _update_state(_state, batch_size, max_concurrency, index_type)
+
+def refresh_embeddings_if_changed(**kwargs):
+    """refresh_embeddings, but only when graph_stamp() moved since the last update. Returns None otherwise."""
+    if graph_stamp() == _graph_stamp:
+        return None
+    return refresh_embeddings(**kwargs)
+
+def embed_question(question):
+    return np.array(embedding_model.embed_query(question)).astype("float32")
+
+def search_embeddings(query, top_k=3, query_embedding=None):
+    if query_embedding is None:
+        query_embedding = embed_question(query)
+    distances, indices = _state.index.search(np.array([query_embedding]), top_k)
     relevant_nodes = [
-        (index_map[i], distances[0][idx])
+        (int(i), distances[0][idx])
         for idx, i in enumerate(indices[0]) if i != -1
     ]
     return relevant_nodes
 
+def search_embeddings_batch(query_embeddings, top_k=3):
+    """One FAISS search for a whole matrix of query embeddings; returns one hit list per row."""
+    distances, indices = _state.index.search(np.ascontiguousarray(query_embeddings, dtype="float32"), top_k)
+    return [
+        [(int(i), distances[row][idx]) for idx, i in enumerate(indices[row]) if i != -1]
+        for row in range(len(indices))
+    ]
+
+def retrieve_details_batch(node_ids):
+    """
+    Fetch description, name, type and outgoing relationships for all node_ids
+    in one call. Results come back in the order of node_ids; ids that no
+    longer exist are skipped. Nodes without outgoing edges are included with
+    an empty relationship list.
+    """
+    return get_graph_store().node_details(node_ids)
+
+def get_contexts_by_id(node_ids, source=LAZY_RAG_CONTEXT_SOURCE):
+    """
+    {node id: context string} for node_ids. Contexts come from the
+    materialized store unless source is "graph"; only ids missing from the
+    store go to the graph. Ids that no longer exist are left out.
+    """
+    store = _state.contexts if source == "store" else {}
+    contexts = {node_id: store[node_id] for node_id in node_ids if node_id in store}
+    missing = [node_id for node_id in node_ids if node_id not in contexts]
+    if missing:
+        contexts.update((details["id"], build_context(details)) for details in retrieve_details_batch(missing))
+    return contexts
+
+def get_contexts(node_ids, source=LAZY_RAG_CONTEXT_SOURCE):
+    """Context strings for node_ids, in order; see get_contexts_by_id."""
+    contexts = get_contexts_by_id(node_ids, source)
+    return [contexts[node_id] for node_id in node_ids if node_id in contexts]
+
 def retrieve_details(node_id):
-    cypher_query = """
-    MATCH (n)-[r]->(m)
-    WHERE id(n) = $node_id
-    RETURN n.description AS description, n.name AS name,
-           [(n)-[r]->(m) | {relation: type(r), target: m.name}] AS relationships
-    """
-    result = graph.query(cypher_query, {"node_id": node_id})
-
-    if result:
-        record = result[0]
-        return {
-            "description": record.get("description"),
-            "name": record.get("name"),
-            "relationships": record.get("relationships", [])
-        }
-    return None
+    details_list = retrieve_details_batch([node_id])
+    return details_list[0] if details_list else None
+
+def build_context(details):
+    return f"Description: {details.get('description', '')}\n" \
+           f"Name: {details.get('name', '')}\n" \
+           f"Relationships: {details.get('relationships', [])}"
 
 def generate_response(question, context):
-    llm = ChatOpenAI(model_name="gpt-4o-mini", api_key=openai_api_key)
-    prompt = f"Given the context:\n{context}\nAnswer the question: {question}\n The answer should include the data from context only not other info"
-    return llm.predict(prompt)
+    return generate_responses(question, [context])[0]
 
-def lazy_rag_query(question, top_k=3):
-    relevant_nodes = search_embeddings(question, top_k)
+def lazy_rag_query(question, top_k=3, query_embedding=None, mode=None):
+    """
+    Answer question from its top_k nearest nodes: one answer per node, or
+    with mode "packed" a single answer from all their contexts packed into
+    one prompt (see llm.contexts_for_mode).
+    """
+    relevant_nodes = search_embeddings(question, top_k, query_embedding)
     if not relevant_nodes:
-        return ["No relevant information found."]
+        return [NO_ANSWER]
+
+    contexts = get_contexts([node_id for node_id, _ in relevant_nodes])
+    return generate_responses(question, contexts_for_mode(contexts, mode))
 
-    responses = []
-    for node_id, _ in relevant_nodes:
-        details = retrieve_details(node_id)
-        if not details:
-            continue
+async def alazy_rag_query(question, top_k=3, query_embedding=None, mode=None):
+    """
+    Async lazy_rag_query for the API. Embedding, FAISS and graph calls run in
+    the event loop's worker threads and generation on the shared LLM loop, so
+    the caller's event loop is never blocked.
+    """
+    relevant_nodes = await asyncio.to_thread(search_embeddings, question, top_k, query_embedding)
+    if not relevant_nodes:
+        return [NO_ANSWER]
+
+    contexts = await asyncio.to_thread(get_contexts, [node_id for node_id, _ in relevant_nodes])
+    return await agenerate_responses(question, contexts_for_mode(contexts, mode))
+
+async def alazy_rag_batch(questions, top_k=3, mode=None):
+    """
+    Answer many questions at once: the questions are embedded in batched
+    calls, searched with one FAISS query over the whole matrix, and the
+    contexts of the union of their hits are looked up at once. Generation then fans out
+    across all questions under the shared LLM concurrency cap.
+    Returns one answer list per question, in input order (one answer each
+    in "packed" mode). A question whose generation failed gets its exception
+    in place of the answer list, so one failure does not discard the others.
+    """
+    if not questions:
+        return []
+
+    query_embeddings = await asyncio.to_thread(embed_texts, questions, embedding_model)
+    hits = await asyncio.to_thread(search_embeddings_batch, query_embeddings, top_k)
+
+    unique_ids = list(dict.fromkeys(node_id for row in hits for node_id, _ in row))
+    contexts_by_id = await asyncio.to_thread(get_contexts_by_id, unique_ids)
+
+    async def answer(question, row):
+        if not row:
+            return [NO_ANSWER]
+        contexts = [contexts_by_id[node_id] for node_id, _ in row if node_id in contexts_by_id]
+        return await agenerate_responses(question, contexts_for_mode(contexts, mode))
+
+    return await asyncio.gather(*(answer(question, row) for question, row in zip(questions, hits)),
+                                return_exceptions=True)
+
+async def alazy_rag_stream(question, top_k=3, query_embedding=None, mode=None):
+    """
+    Streaming alazy_rag_query. Yields event dicts as the pipeline progresses:
+    {"event": "stage", "stage": ..., "seconds": ...} after each of the embed,
+    search, context and generate stages, {"event": "token", "index": ..., "text": ...}
+    for every generated chunk and {"event": "answer", ...} (or "error") when
+    the answer for the node ranked index is complete. In "packed" mode there
+    is a single answer, with index 0.
+    """
+    if query_embedding is None:
+        start = time.perf_counter()
+        query_embedding = await asyncio.to_thread(embed_question, question)
+        yield {"event": "stage", "stage": "embed", "seconds": time.perf_counter() - start}
+
+    start = time.perf_counter()
+    relevant_nodes = await asyncio.to_thread(search_embeddings, question, top_k, query_embedding)
+    yield {"event": "stage", "stage": "search", "seconds": time.perf_counter() - start}
+    if not relevant_nodes:
+        yield {"event": "answer", "index": 0, "text": NO_ANSWER}
+        return
 
-        context = f"Description: {details.get('description', '')}\n" \
-                  f"Name: {details.get('name', '')}\n" \
-                  f"Relationships: {details.get('relationships', [])}"
-        response = generate_response(question, context)
-        responses.append(response)
+    start = time.perf_counter()
+    contexts = await asyncio.to_thread(get_contexts, [node_id for node_id, _ in relevant_nodes])
+    yield {"event": "stage", "stage": "context", "seconds": time.perf_counter() - start}
 
-    return responses
+    start = time.perf_counter()
+    async for kind, index, text in astream_responses(question, contexts_for_mode(contexts, mode)):
+        yield {"event": kind, "index": index, "text": text}
+    yield {"event": "stage", "stage": "generate", "seconds": time.perf_counter() - start}
 
 
 if __name__ == "__main__":
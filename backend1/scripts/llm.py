@@ -0,0 +1,269 @@
+import asyncio
+import os
+import random
+import threading
+
+import openai
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")  # or "fake" for offline runs and load tests
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF = float(os.getenv("LLM_BACKOFF", "0.5"))
+LLM_FAKE_LATENCY = float(os.getenv("LLM_FAKE_LATENCY", "0.5"))
+# Tokens of retrieved context packed into the single prompt of "packed" mode
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# "per_node" answers once per retrieved node (top_k LLM calls and answers); "packed" merges
+# the retrieved contexts into one prompt and returns a single answer from one call
+RAG_ANSWER_MODE = os.getenv("RAG_ANSWER_MODE", "per_node")
+# Word-shingle Jaccard similarity at which a context counts as a near duplicate of a better-ranked one
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+
+PROMPT_TEMPLATE = (
+    "Given the context:\n{context}\nAnswer the question: {question}\n"
+    " The answer should include the data from context only not other info"
+)
+
+ANSWER_MODES = ("per_node", "packed")
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+_RETRYABLE_ERRORS = (
+    asyncio.TimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+# All LLM traffic runs on one background event loop, so that a single
+# ChatOpenAI client (and its HTTP connection pool) and a single concurrency
+# cap are shared by every caller, sync or async.
+_loop = None
+_loop_lock = threading.Lock()
+_llm = None
+_semaphore = None
+
+
+def _get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-loop", daemon=True).start()
+    return _loop
+
+
+class FakeChatModel:
+    """Offline stand-in for ChatOpenAI that answers after a fixed delay."""
+
+    def __init__(self, latency=LLM_FAKE_LATENCY):
+        self.latency = latency
+
+    @staticmethod
+    def _answer(prompt):
+        context = prompt.split("Given the context:\n", 1)[-1].split("\nAnswer the question:", 1)[0]
+        return f"Based on the context: {context.splitlines()[0] if context else ''}"
+
+    async def ainvoke(self, prompt):
+        from langchain_core.messages import AIMessage
+        await asyncio.sleep(self.latency)
+        return AIMessage(content=self._answer(prompt))
+
+    async def astream(self, prompt):
+        from langchain_core.messages import AIMessageChunk
+        words = self._answer(prompt).split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(self.latency / len(words))
+            yield AIMessageChunk(content=word if i == 0 else " " + word)
+
+
+def get_llm():
+    global _llm
+    if _llm is None:
+        if LLM_PROVIDER == "fake":
+            _llm = FakeChatModel()
+        else:
+            from langchain_openai import ChatOpenAI
+            # Retries are handled by _generate so they respect the concurrency cap.
+            _llm = ChatOpenAI(model_name=LLM_MODEL, api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+    return _llm
+
+
+def build_prompt(question, context):
+    return PROMPT_TEMPLATE.format(context=context, question=question)
+
+
+_encoding = None
+
+
+def count_tokens(text):
+    """Tokens of text for LLM_MODEL, or about 4 characters per token when tiktoken is not installed."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            try:
+                _encoding = tiktoken.encoding_for_model(LLM_MODEL)
+            except KeyError:
+                _encoding = tiktoken.get_encoding("cl100k_base")
+        except ImportError:
+            _encoding = False
+    if _encoding is False:
+        return (len(text) + 3) // 4
+    return len(_encoding.encode(text))
+
+
+def _shingles(text, size=3):
+    words = text.lower().split()
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+
+def pack_contexts(contexts, token_budget=CONTEXT_TOKEN_BUDGET, dedup_threshold=CONTEXT_DEDUP_THRESHOLD):
+    """
+    Merge contexts, best ranked first, into one context string of at most
+    token_budget tokens. A context whose word shingles overlap an already
+    packed one by dedup_threshold or more (Jaccard) is dropped, as is one
+    that no longer fits; later, shorter contexts may still fit. If even the
+    best context is over budget, it is cut to fit.
+    """
+    packed = []
+    packed_shingles = []
+    used = 0
+    separator_tokens = count_tokens(CONTEXT_SEPARATOR)
+    for context in contexts:
+        shingles = _shingles(context)
+        if any(len(shingles & other) / len(shingles | other) >= dedup_threshold for other in packed_shingles):
+            continue
+        tokens = count_tokens(context) + (separator_tokens if packed else 0)
+        if used + tokens > token_budget:
+            if packed:
+                continue
+            while tokens > token_budget:
+                context = context[:len(context) * token_budget // tokens]
+                tokens = count_tokens(context)
+        packed.append(context)
+        packed_shingles.append(shingles)
+        used += tokens
+    return CONTEXT_SEPARATOR.join(packed)
+
+
+def contexts_for_mode(contexts, mode=None):
+    """The contexts to answer from in mode (RAG_ANSWER_MODE by default): as they are, or packed into one."""
+    mode = mode or RAG_ANSWER_MODE
+    if mode not in ANSWER_MODES:
+        raise ValueError(f"Unknown answer mode {mode!r}, expected one of {ANSWER_MODES}")
+    return [pack_contexts(contexts)] if mode == "packed" and contexts else contexts
+
+
+def _get_semaphore():
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return _semaphore
+
+
+async def _generate(prompt, timeout, max_retries, backoff):
+    for attempt in range(max_retries + 1):
+        try:
+            async with _get_semaphore():
+                message = await asyncio.wait_for(get_llm().ainvoke(prompt), timeout)
+            return message.content
+        except _RETRYABLE_ERRORS:
+            if attempt == max_retries:
+                raise
+            await asyncio.sleep(backoff * 2 ** attempt * (1 + random.random()))
+
+
+async def _generate_all(question, contexts, timeout, max_retries, backoff):
+    return await asyncio.gather(
+        *(_generate(build_prompt(question, context), timeout, max_retries, backoff) for context in contexts)
+    )
+
+
+async def agenerate_responses(question, contexts, timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES,
+                              backoff=LLM_BACKOFF):
+    """
+    Answer question once per context, concurrently, keeping the order of contexts.
+
+    At most LLM_MAX_CONCURRENCY calls are in flight across all callers. Each
+    call is bounded by timeout seconds and retried up to max_retries times
+    with exponential backoff on timeouts, rate limits and server errors.
+    """
+    future = asyncio.run_coroutine_threadsafe(
+        _generate_all(question, contexts, timeout, max_retries, backoff), _get_loop()
+    )
+    return await asyncio.wrap_future(future)
+
+
+def generate_responses(question, contexts, timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES,
+                       backoff=LLM_BACKOFF):
+    """Blocking version of agenerate_responses."""
+    future = asyncio.run_coroutine_threadsafe(
+        _generate_all(question, contexts, timeout, max_retries, backoff), _get_loop()
+    )
+    return future.result()
+
+
+async def _stream(index, prompt, emit, timeout, max_retries, backoff):
+    for attempt in range(max_retries + 1):
+        parts = []
+
+        async def consume():
+            async for chunk in get_llm().astream(prompt):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    emit(("token", index, chunk.content))
+
+        try:
+            async with _get_semaphore():
+                await asyncio.wait_for(consume(), timeout)
+            emit(("answer", index, "".join(parts)))
+            return
+        except _RETRYABLE_ERRORS:
+            # Tokens already sent cannot be taken back, so only retry before the first one.
+            if parts or attempt == max_retries:
+                raise
+            await asyncio.sleep(backoff * 2 ** attempt * (1 + random.random()))
+
+
+async def _stream_all(question, contexts, emit, timeout, max_retries, backoff):
+    async def run(index, context):
+        try:
+            await _stream(index, build_prompt(question, context), emit, timeout, max_retries, backoff)
+        except Exception as e:
+            emit(("error", index, str(e)))
+
+    await asyncio.gather(*(run(index, context) for index, context in enumerate(contexts)))
+
+
+async def astream_responses(question, contexts, timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES,
+                            backoff=LLM_BACKOFF):
+    """
+    Streaming version of agenerate_responses.
+
+    Yields (kind, index, text) events as they happen: "token" for each
+    generated chunk, then "answer" with the full text (or "error" with the
+    message) once the answer for contexts[index] is complete. Answers finish
+    in completion order, not rank order; index gives the rank.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    def emit(event):
+        loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    future = asyncio.run_coroutine_threadsafe(
+        _stream_all(question, contexts, emit, timeout, max_retries, backoff), _get_loop()
+    )
+    try:
+        remaining = len(contexts)
+        while remaining:
+            event = await queue.get()
+            if event[0] != "token":
+                remaining -= 1
+            yield event
+    finally:
+        future.cancel()
@@ -0,0 +1,60 @@
+import asyncio
+import statistics
+import sys
+import time
+
+import httpx
+
+QUESTIONS = [
+    "What was the impact of the pandemic on India's economy?",
+    "The prices of what increased in FY23 due to the Russia-Ukraine conflict?",
+    "What was the fiscal deficit of states in FY24?",
+    "How did digitalisation change service delivery?",
+]
+
+
+async def run_level(client, url, concurrency, requests_per_worker, top_k=3):
+    """Send concurrency * requests_per_worker queries with concurrency in flight; return latencies."""
+    latencies = []
+    errors = 0
+
+    async def worker(worker_id):
+        nonlocal errors
+        for i in range(requests_per_worker):
+            question = QUESTIONS[(worker_id + i) % len(QUESTIONS)]
+            start = time.perf_counter()
+            response = await client.post(url, json={"question": question, "top_k": top_k, "use_cache": False})
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+async def main(base_url, endpoint, levels, requests_per_worker):
+    url = f"{base_url.rstrip('/')}/{endpoint}"
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    async with httpx.AsyncClient(timeout=300, limits=limits) as client:
+        print(f"Load test against {url} ({requests_per_worker} requests per client)")
+        print(f"{'clients':>8} {'req/s':>8} {'p50 s':>8} {'p95 s':>8} {'errors':>7}")
+        for concurrency in levels:
+            latencies, errors, elapsed = await run_level(client, url, concurrency, requests_per_worker)
+            if not latencies:
+                print(f"{concurrency:>8} {'-':>8} {'-':>8} {'-':>8} {errors:>7}")
+                continue
+            latencies.sort()
+            p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+            print(f"{concurrency:>8} {len(latencies) / elapsed:>8.2f} "
+                  f"{statistics.median(latencies):>8.2f} {p95:>8.2f} {errors:>7}")
+
+
+if __name__ == "__main__":
+    # Usage: python -m scripts.load_test [base_url] [endpoint]
+    # Throughput (req/s) should grow with the number of concurrent clients
+    # until LLM_MAX_CONCURRENCY or RAG_WORKER_THREADS is reached.
+    base_url = sys.argv[1] if len(sys.argv) > 1 else "http://127.0.0.1:8000"
+    endpoint = sys.argv[2] if len(sys.argv) > 2 else "lazy_rag"
+    asyncio.run(main(base_url, endpoint, levels=[1, 2, 4, 8, 16], requests_per_worker=4))
@@ -1,94 +1,124 @@
+import asyncio
 import os
-from langchain_openai import ChatOpenAI
-from langchain_neo4j import Neo4jGraph
-from langchain.embeddings import OpenAIEmbeddings
+import time
 import numpy as np
 from dotenv import load_dotenv
+from scripts.answer_cache import NO_ANSWER
+from scripts.embeddings import get_embedding_model
+from scripts.graph_store import get_graph_store
+from scripts.llm import agenerate_responses, astream_responses, contexts_for_mode, generate_responses
 
 load_dotenv()
 
 # OpenAI API key
 openai_api_key = os.getenv("OPENAI_API_KEY")
 
-# Neo4j connection details
-neo4j_url = "bolt://localhost:7689"
-neo4j_username = "neo4j"
-neo4j_password = "12345678"
+embedding_model = get_embedding_model()
 
-graph = Neo4jGraph(
-    url=neo4j_url,
-    username=neo4j_username,
-    password=neo4j_password
-)
+# "off" keeps Naive RAG a pure no-precomputation baseline that embeds every
+# node on every query; "on" reads node embeddings through EmbeddingCache.
+NAIVE_RAG_EMBEDDING_CACHE = os.getenv("NAIVE_RAG_EMBEDDING_CACHE", "off")
+_embedding_cache = None
 
-embedding_model = OpenAIEmbeddings(openai_api_key=openai_api_key)
 
-def search_and_retrieve(question, top_k=3):
-    query_embedding = np.array(embedding_model.embed_query(question)).astype("float32")
+def get_embedding_cache():
+    global _embedding_cache
+    if _embedding_cache is None:
+        from scripts.embedding_cache import EmbeddingCache
+        _embedding_cache = EmbeddingCache(embedding_model)
+    return _embedding_cache
 
-    cypher_query = """
-    MATCH (n)
-    RETURN id(n) AS id, COALESCE(n.description, n.name) AS text
-    """
-    results = graph.query(cypher_query)
+
+def embed_question(question):
+    return np.array(embedding_model.embed_query(question)).astype("float32")
+
+def search_and_retrieve(question, top_k=3, use_cache=None, query_embedding=None):
+    if use_cache is None:
+        use_cache = NAIVE_RAG_EMBEDDING_CACHE == "on"
+
+    if query_embedding is None:
+        query_embedding = embed_question(question)
 
     nodes = []
     embeddings = []
-    for record in results:
-        node_id = record["id"]
-        text = record["text"]
-        if text:
-            nodes.append({"id": node_id, "text": text})
+    for node_id, text in get_graph_store().node_texts():
+        nodes.append({"id": node_id, "text": text})
+        if not use_cache:
             embeddings.append(np.array(embedding_model.embed_query(text)).astype("float32"))
 
+    if use_cache and nodes:
+        embeddings = get_embedding_cache().embed([node["text"] for node in nodes])
+
     distances = [np.linalg.norm(query_embedding - node_emb) for node_emb in embeddings]
     ranked_indices = np.argsort(distances)[:top_k]
 
     relevant_nodes = [{"id": nodes[i]["id"], "text": nodes[i]["text"], "distance": distances[i]} for i in ranked_indices]
     return relevant_nodes
 
-def retrieve_details(node_id):
-    cypher_query = """
-    MATCH (n)-[r]->(m)
-    WHERE id(n) = $node_id
-    RETURN n.description AS description, n.name AS name,
-           [(n)-[r]->(m) | {relation: type(r), target: m.name}] AS relationships
+def retrieve_details_batch(node_ids):
     """
-    result = graph.query(cypher_query, {"node_id": node_id})
+    Fetch description, name, type and outgoing relationships for all node_ids
+    in one call. Results come back in the order of node_ids; ids that no
+    longer exist are skipped. Nodes without outgoing edges are included with
+    an empty relationship list.
+    """
+    return get_graph_store().node_details(node_ids)
+
+def retrieve_details(node_id):
+    details_list = retrieve_details_batch([node_id])
+    return details_list[0] if details_list else None
 
-    if result:
-        record = result[0]
-        return {
-            "description": record.get("description"),
-            "name": record.get("name"),
-            "relationships": record.get("relationships", [])
-        }
-    return None
+def build_context(details):
+    return f"Description: {details.get('description', '')}\n" \
+           f"Name: {details.get('name', '')}\n" \
+           f"Relationships: {details.get('relationships', [])}"
 
 def generate_response(question, context):
-    llm = ChatOpenAI(model_name="gpt-4o-mini", api_key=openai_api_key)
-    prompt = f"Given the context:\n{context}\nAnswer the question: {question}\n  The answer should include the data from context only not other info"
-    return llm.predict(prompt)
+    return generate_responses(question, [context])[0]
 
-def naive_rag_query(question, top_k=3):
-    relevant_nodes = search_and_retrieve(question, top_k)
+def naive_rag_query(question, top_k=3, query_embedding=None, mode=None):
+    relevant_nodes = search_and_retrieve(question, top_k, query_embedding=query_embedding)
 
     if not relevant_nodes:
-        return ["No relevant information found."]
+        return [NO_ANSWER]
 
-    responses = []
-    for node in relevant_nodes:
-        details = retrieve_details(node["id"])
-        if not details:
-            continue
+    details_list = retrieve_details_batch([node["id"] for node in relevant_nodes])
+    contexts = [build_context(details) for details in details_list]
+    return generate_responses(question, contexts_for_mode(contexts, mode))
 
-        context = f"Description: {details.get('description', '')}\n" \
-                  f"Name: {details.get('name', '')}\n" \
-                  f"Relationships: {details.get('relationships', [])}"
-        response = generate_response(question, context)
-        responses.append(response)
-
-    return responses
+async def anaive_rag_query(question, top_k=3, query_embedding=None, mode=None):
+    """Async naive_rag_query; see lazy_rag.alazy_rag_query."""
+    relevant_nodes = await asyncio.to_thread(search_and_retrieve, question, top_k, None, query_embedding)
+    if not relevant_nodes:
+        return [NO_ANSWER]
+
+    details_list = await asyncio.to_thread(retrieve_details_batch, [node["id"] for node in relevant_nodes])
+    contexts = [build_context(details) for details in details_list]
+    return await agenerate_responses(question, contexts_for_mode(contexts, mode))
+
+async def anaive_rag_stream(question, top_k=3, query_embedding=None, mode=None):
+    """Streaming anaive_rag_query; yields the same events as lazy_rag.alazy_rag_stream."""
+    if query_embedding is None:
+        start = time.perf_counter()
+        query_embedding = await asyncio.to_thread(embed_question, question)
+        yield {"event": "stage", "stage": "embed", "seconds": time.perf_counter() - start}
+
+    start = time.perf_counter()
+    relevant_nodes = await asyncio.to_thread(search_and_retrieve, question, top_k, None, query_embedding)
+    yield {"event": "stage", "stage": "search", "seconds": time.perf_counter() - start}
+    if not relevant_nodes:
+        yield {"event": "answer", "index": 0, "text": NO_ANSWER}
+        return
+
+    start = time.perf_counter()
+    details_list = await asyncio.to_thread(retrieve_details_batch, [node["id"] for node in relevant_nodes])
+    yield {"event": "stage", "stage": "graph", "seconds": time.perf_counter() - start}
+
+    start = time.perf_counter()
+    contexts = [build_context(details) for details in details_list]
+    async for kind, index, text in astream_responses(question, contexts_for_mode(contexts, mode)):
+        yield {"event": kind, "index": index, "text": text}
+    yield {"event": "stage", "stage": "generate", "seconds": time.perf_counter() - start}
 
 # if __name__ == "__main__":
 #     question = "What was the impact of the pandemic on India's economy?"
@@ -0,0 +1,45 @@
+import json
+
+
+def write_structured_jsonl(path, records):
+    """
+    Write (kind, record) pairs, kind being "entity" or "relationship", as
+    JSONL with one record per line and its kind in a "kind" field. records
+    may be a generator; nothing is held in memory. Entities and
+    relationships may be interleaved. Returns the number of lines written.
+    """
+    lines = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for kind, record in records:
+            f.write(json.dumps({"kind": kind, **record}) + "\n")
+            lines += 1
+    return lines
+
+
+def structured_records(entities, relationships):
+    """(kind, record) pairs of entities followed by relationships, for write_structured_jsonl."""
+    for entity in entities:
+        yield "entity", entity
+    for relationship in relationships:
+        yield "relationship", relationship
+
+
+def iter_structured_data(path, kind):
+    """
+    Yield the records of one kind ("entity" or "relationship") from a
+    structured data file. JSONL files are streamed line by line, so a
+    loader reads the file once per kind; the older single-document .json
+    format is still read, but in one piece.
+    """
+    if not path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            yield from json.load(f).get("entities" if kind == "entity" else "relationships", [])
+        return
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.pop("kind", None) == kind:
+                yield record
@@ -1,8 +1,92 @@
+// Render a server-sent event stream from /<method>/stream, filling in each
+// answer as its tokens arrive. Returns false, having shown nothing, when the
+// server has no streaming endpoint (the `backend` server).
+async function streamQuery(method, query, chatContainer) {
+    const response = await fetch(`http://127.0.0.1:8000/${method}/stream`, {
+        method: "POST",
+        headers: {
+            "Content-Type": "application/json",
+        },
+        body: JSON.stringify({ question: query, top_k: 3 }),
+    });
+
+    if (response.status === 404) {
+        return false;
+    }
+    if (!response.ok) {
+        const error = await response.json();
+        throw new Error(error.detail || "Error fetching results");
+    }
+
+    const statsMessage = document.createElement("div");
+    statsMessage.classList.add("message", "assistant");
+    statsMessage.innerHTML = "<em>Thinking...</em>";
+    chatContainer.appendChild(statsMessage);
+
+    const stages = [];
+    const answerElements = {};
+    const answerElement = (index) => {
+        if (!answerElements[index]) {
+            const element = document.createElement("div");
+            element.classList.add("message", "assistant");
+            element.innerHTML = `<strong>Answer ${index + 1}:</strong> <span></span>`;
+            // Keep answers in rank order even though they finish out of order
+            const next = Object.keys(answerElements).map(Number).filter((i) => i > index).sort((a, b) => a - b)[0];
+            chatContainer.insertBefore(element, next === undefined ? null : answerElements[next]);
+            answerElements[index] = element;
+        }
+        return answerElements[index].querySelector("span");
+    };
+
+    const handleEvent = (event, data) => {
+        if (event === "stage") {
+            stages.push(`${data.stage} ${data.seconds.toFixed(2)}s`);
+            statsMessage.innerHTML = `<em>${stages.join(" · ")}</em>`;
+        } else if (event === "token") {
+            answerElement(data.index).textContent += data.text;
+        } else if (event === "answer") {
+            answerElement(data.index).textContent = data.text;
+        } else if (event === "error") {
+            const target = data.index === undefined ? statsMessage : answerElement(data.index);
+            target.textContent = `Error: ${data.text || data.detail}`;
+        } else if (event === "done") {
+            statsMessage.innerHTML = `<strong>Time Taken:</strong> ${data.time_taken.toFixed(2)} seconds<br>
+                <strong>CPU Usage:</strong> ${data.cpu_usage.toFixed(2)}%<br>
+                <small>${stages.join(" · ")}${data.cache_hit ? " · cached" : ""}</small>`;
+        }
+        chatContainer.scrollTop = chatContainer.scrollHeight;
+    };
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+            const block = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            let event = "message";
+            let data = "";
+            block.split("\n").forEach((line) => {
+                if (line.startsWith("event: ")) event = line.slice(7);
+                else if (line.startsWith("data: ")) data += line.slice(6);
+            });
+            if (data) handleEvent(event, JSON.parse(data));
+        }
+    }
+    return true;
+}
+
 document.getElementById("queryForm").addEventListener("submit", async (event) => {
     event.preventDefault();
 
     const query = document.getElementById("query").value.trim();
     const method = document.getElementById("ragMethod").value;
+    const stream = document.getElementById("streamAnswers").checked;
     const chatContainer = document.getElementById("chat-container");
 
     if (!query) {
@@ -21,6 +105,10 @@ document.getElementById("queryForm").addEventListener("submit", async (event) =>
 
     // Send the query to FastAPI backend
     try {
+        if (stream && await streamQuery(method, query, chatContainer)) {
+            return;
+        }
+
         const startTime = performance.now(); // Start timer
         const response = await fetch(`http://127.0.0.1:8000/${method}`, {
             method: "POST",